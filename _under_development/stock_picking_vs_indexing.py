@@ -1,7 +1,7 @@
-import yfinance as yf
 import pandas as pd
 import numpy as np
 import datetime
+from scripts.data_providers import fetch_prices
 
 
 def fetch_sp500_tickers():
@@ -12,9 +12,10 @@ def fetch_sp500_tickers():
 
 
 def get_historical_data(tickers, start_date, end_date):
-    # Fetch historical data for given tickers
-    data = yf.download(tickers, start=start_date, end=end_date)
-    return data['Adj Close']
+    # Fetch historical data for given tickers concurrently
+    data = fetch_prices(tickers, start=start_date, end=end_date,
+                        skip_missing=True)
+    return pd.concat(data, axis=1)
 
 
 def calculate_returns(data):
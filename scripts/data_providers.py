@@ -0,0 +1,244 @@
+"""
+Summary: Asynchronous price data providers.
+
+A provider fetches closing prices per ticker through an async interface.
+fetch_many loads several tickers concurrently, limited to max_concurrency
+requests in flight and at most requests_per_second request starts, so
+multi-ticker loads overlap their I/O. Backends:
+- YFinanceProvider: Yahoo Finance (default)
+- LocalFileProvider: <ticker>.parquet / <ticker>.csv files in a directory
+- FakeServerProvider: in-process series with simulated latency, for tests
+The synchronous helper fetch_prices uses the provider set with
+set_provider and works inside running event loops (e.g. notebooks).
+"""
+
+import asyncio
+import os
+import threading
+import time
+import pandas as pd
+from typing import Dict, List, Optional
+
+
+def read_series_file(path: str) -> pd.Series:
+    """Read a series from a CSV or Parquet file (index = dates, first
+    column = values)"""
+    if path.endswith('.parquet'):
+        data = pd.read_parquet(path)
+    else:
+        data = pd.read_csv(path, index_col=0, parse_dates=True)
+    series = data.iloc[:, 0] if isinstance(data, pd.DataFrame) else data
+    series.index = pd.DatetimeIndex(series.index)
+    return pd.to_numeric(series, errors='coerce').dropna().sort_index()
+
+
+def select_dates(series: pd.Series, start: Optional[str],
+                 end: Optional[str]) -> pd.Series:
+    """Restrict a series to [start, end), like yf.download"""
+    if start is not None:
+        series = series[series.index >= pd.Timestamp(start)]
+    if end is not None:
+        series = series[series.index < pd.Timestamp(end)]
+    return series
+
+
+class DataProvider:
+    """
+    Base class of all providers. Subclasses implement fetch.
+
+    Parameters:
+    max_concurrency (int): Maximum number of requests in flight.
+    requests_per_second (float): Optional limit of request starts.
+    """
+
+    def __init__(self, max_concurrency: int = 4,
+                 requests_per_second: Optional[float] = None):
+        self.max_concurrency = max_concurrency
+        self.requests_per_second = requests_per_second
+
+    async def fetch(self, ticker: str, start: Optional[str] = None,
+                    end: Optional[str] = None) -> pd.Series:
+        """Closing prices of a ticker on its trading days. Without start
+        and end the full history is returned"""
+        raise NotImplementedError
+
+    async def fetch_many(self, tickers: List[str],
+                         start: Optional[str] = None,
+                         end: Optional[str] = None,
+                         skip_missing: bool = False) -> Dict[str, pd.Series]:
+        """Fetch several tickers concurrently within the rate limits.
+        With skip_missing, tickers failing to load are left out instead of
+        raising"""
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        interval = 1 / self.requests_per_second \
+            if self.requests_per_second else 0
+        next_start = [time.monotonic()]
+
+        async def limited_fetch(ticker):
+            async with semaphore:
+                now = time.monotonic()
+                wait = next_start[0] - now
+                next_start[0] = max(next_start[0], now) + interval
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                return await self.fetch(ticker, start, end)
+
+        series = await asyncio.gather(*(limited_fetch(ticker)
+                                        for ticker in tickers),
+                                      return_exceptions=skip_missing)
+        return {ticker: data for ticker, data in zip(tickers, series)
+                if not isinstance(data, Exception)}
+
+
+class YFinanceProvider(DataProvider):
+    """
+    Yahoo Finance via yfinance, each download runs in a worker thread.
+    Uses the per-ticker Ticker.history API: yf.download keeps its results
+    in module-global state, so concurrent calls could mix up tickers.
+    """
+
+    async def fetch(self, ticker: str, start: Optional[str] = None,
+                    end: Optional[str] = None) -> pd.Series:
+        return await asyncio.to_thread(self._download, ticker, start, end)
+
+    @staticmethod
+    def _download(ticker: str, start: Optional[str],
+                  end: Optional[str]) -> pd.Series:
+        import yfinance as yf
+        if start is None and end is None:
+            data = yf.Ticker(ticker).history(period='max', auto_adjust=True)
+        else:
+            data = yf.Ticker(ticker).history(start=start, end=end,
+                                             auto_adjust=True)
+        if data.empty:
+            raise ValueError(f"No data for {ticker}")
+        prices = data['Close'].dropna().rename(ticker)
+        # Trading days as naive dates, like yf.download
+        prices.index = prices.index.tz_localize(None).normalize()
+        return prices
+
+
+class LocalFileProvider(DataProvider):
+    """Prices from <directory>/<ticker>.parquet or <ticker>.csv"""
+
+    def __init__(self, directory: str, **kwargs):
+        super().__init__(**kwargs)
+        self.directory = directory
+
+    async def fetch(self, ticker: str, start: Optional[str] = None,
+                    end: Optional[str] = None) -> pd.Series:
+        for extension in ('.parquet', '.csv'):
+            path = os.path.join(self.directory, ticker + extension)
+            if os.path.isfile(path):
+                series = await asyncio.to_thread(read_series_file, path)
+                return select_dates(series, start, end).rename(ticker)
+        raise ValueError(f"No local data for {ticker} in {self.directory}")
+
+
+class FakeServerProvider(DataProvider):
+    """
+    In-process stand-in for a remote price server, for tests.
+
+    Parameters:
+    data (Dict[str, pd.Series]): Prices per ticker.
+    latency (float): Simulated seconds per request.
+    """
+
+    def __init__(self, data: Dict[str, pd.Series], latency: float = 0.0,
+                 **kwargs):
+        super().__init__(**kwargs)
+        self.data = data
+        self.latency = latency
+        self.requests = []
+
+    async def fetch(self, ticker: str, start: Optional[str] = None,
+                    end: Optional[str] = None) -> pd.Series:
+        self.requests.append(ticker)
+        await asyncio.sleep(self.latency)
+        if ticker not in self.data:
+            raise ValueError(f"No data for {ticker}")
+        return select_dates(self.data[ticker], start, end).rename(ticker)
+
+
+_provider: DataProvider = YFinanceProvider()
+
+
+def get_provider() -> DataProvider:
+    """The provider used by all studies"""
+    return _provider
+
+
+def set_provider(provider: DataProvider):
+    """Replace the provider used by all studies"""
+    global _provider
+    _provider = provider
+
+
+def run_sync(coroutine):
+    """Run a coroutine to completion, also from inside a running event
+    loop (as in Jupyter) by using a separate thread"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+
+    result = {}
+
+    def runner():
+        try:
+            result['value'] = asyncio.run(coroutine)
+        except BaseException as error:
+            result['error'] = error
+
+    thread = threading.Thread(target=runner)
+    thread.start()
+    thread.join()
+    if 'error' in result:
+        raise result['error']
+    return result['value']
+
+
+def fetch_prices(tickers: List[str], start: Optional[str] = None,
+                 end: Optional[str] = None,
+                 provider: Optional[DataProvider] = None,
+                 skip_missing: bool = False) -> Dict[str, pd.Series]:
+    """Synchronously fetch closing prices of several tickers concurrently"""
+    provider = get_provider() if provider is None else provider
+    return run_sync(provider.fetch_many(list(tickers), start, end,
+                                        skip_missing))
+
+
+if __name__ == "__main__":
+    # Check that concurrent fetches return the data of the right ticker,
+    # also when later requests finish first
+    import tempfile
+    import numpy as np
+
+    class ReversedLatencyProvider(FakeServerProvider):
+        """Fake server answering later tickers faster"""
+
+        async def fetch(self, ticker, start=None, end=None):
+            await asyncio.sleep(0.01 * (len(self.data) - list(
+                self.data).index(ticker)))
+            return await super().fetch(ticker, start, end)
+
+    dates = pd.bdate_range('2000-01-03', periods=500)
+    dummy_data = {ticker: pd.Series(np.arange(500) + 1000 * number,
+                                    index=dates, dtype=float)
+                  for number, ticker in enumerate('ABCDEFGH')}
+    with tempfile.TemporaryDirectory() as directory:
+        for ticker, series in dummy_data.items():
+            series.rename('Close').to_csv(
+                os.path.join(directory, ticker + '.csv'))
+        for provider in (ReversedLatencyProvider(dummy_data,
+                                                 max_concurrency=8),
+                         LocalFileProvider(directory, max_concurrency=8)):
+            fetched = fetch_prices(dummy_data, '2000-06-01', provider=provider)
+            assert list(fetched) == list(dummy_data)
+            for ticker, series in fetched.items():
+                expected = select_dates(dummy_data[ticker], '2000-06-01',
+                                        None)
+                assert series.name == ticker
+                assert series.index.equals(expected.index)
+                assert np.array_equal(series.to_numpy(), expected.to_numpy())
+    print("Concurrent fetches return the requested tickers")
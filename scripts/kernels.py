@@ -0,0 +1,73 @@
+"""
+Summary: Optional JIT-compiled kernels for path-dependent simulations.
+
+Recurrences that are sequential in time (tax on an evolving cost basis,
+portfolios ending once depleted) run as compiled loops over plain float
+arrays, parallelized across start dates. numba is optional: without it
+NUMBA_AVAILABLE is False and the cores use their pure-NumPy implementation.
+"""
+
+import numpy as np
+
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        """Stand-in decorator leaving functions uncompiled"""
+        return lambda func: func
+
+
+@njit(parallel=True, cache=True, error_model='numpy')
+def withdrawal_months_kernel(prices: np.ndarray, step_grid: np.ndarray,
+                             withdrawal_scale: np.ndarray,
+                             withdrawal_growth: np.ndarray,
+                             initial_value: float, initial_invested: float,
+                             tax_rate: float,
+                             tax_free_threshold: float) -> np.ndarray:
+    """
+    Months lasted of the fixed withdrawal plan with proportional cost basis,
+    one independent path per allocation and start date.
+
+    Parameters:
+    prices (np.ndarray): Prices, shape (allocations, trading days).
+    step_grid (np.ndarray): Withdrawal date positions, shape (windows,
+    steps + 1).
+    withdrawal_scale (np.ndarray): Initial monthly withdrawal, shape
+    (allocations, windows).
+    withdrawal_growth (np.ndarray): Inflation factor per step.
+    tax_free_threshold (float): Monthly tax-free amount.
+
+    Returns:
+    np.ndarray: Months lasted, shape (allocations, windows).
+    """
+    num_allocations = prices.shape[0]
+    num_windows, num_steps = step_grid.shape[0], step_grid.shape[1] - 1
+    months_lasted = np.zeros((num_allocations, num_windows))
+
+    for path in prange(num_allocations * num_windows):
+        allocation, window = path // num_windows, path % num_windows
+        portfolio_value = initial_value
+        cost_basis = initial_invested
+        months = 0
+        for step in range(num_steps):
+            if not portfolio_value > 0:
+                break
+            monthly_return = (prices[allocation, step_grid[window, step + 1]]
+                              / prices[allocation, step_grid[window, step]]
+                              ) - 1
+            withdrawal = (withdrawal_scale[allocation, window] *
+                          withdrawal_growth[step])
+            taxable_amount = max(
+                (withdrawal - tax_free_threshold) -
+                cost_basis * (withdrawal / portfolio_value), 0)
+            portfolio_value -= withdrawal + taxable_amount * tax_rate
+            cost_basis *= (1 - withdrawal / portfolio_value)
+            portfolio_value *= (1 + monthly_return)
+            months += 1
+        months_lasted[allocation, window] = months
+
+    return months_lasted
@@ -1,49 +1,104 @@
 """Core functionality for comparing Lump Sum vs DCA"""
-from datetime import datetime
+import numpy as np
 import pandas as pd
-from typing import Dict
-from scripts.utils import download_stock_data, scale_price_data
+from typing import Dict, Iterator
+from scripts.price_data import load_scaled_config_prices
+from scripts.trading_calendar import TradingCalendar, MonthlyPanel
+from scripts.streaming_stats import StreamingSummary, log_bins, chunk_slices
 
+# Number of monthly DCA investments
+DCA_MONTHS = 12
 
-def simulate_lump_sum(prices: pd.Series, start_date: datetime,
-                      end_date: datetime, config: Dict) -> float:
-    """Simulate lump sum investment strategy"""
-    shares = config['initial_investment'] / prices.loc[start_date]
-    return shares * prices.loc[end_date]
 
+def simulate_lump_sum(prices: np.ndarray, starts: np.ndarray,
+                      ends: np.ndarray, config: Dict) -> np.ndarray:
+    """Simulate lump sum investment strategy for many windows at once"""
+    shares = config['initial_investment'] / prices[starts]
+    return shares * prices[ends]
 
-def simulate_dca(prices: pd.Series, start_date: datetime,
-                 end_date: datetime, config: Dict) -> float:
-    """Simulate 12-month Dollar-Cost Averaging strategy"""
-    monthly_dates = pd.date_range(start=start_date, periods=12, freq='ME')
-    total_shares = 0
 
-    for date in monthly_dates:
-        if date > end_date or date not in prices.index:
-            continue
-        shares = config['monthly_investment'] / prices.loc[date]
-        total_shares += shares
+def simulate_dca(prices: np.ndarray, panel: MonthlyPanel,
+                 starts: np.ndarray, ends: np.ndarray,
+                 config: Dict) -> np.ndarray:
+    """Simulate 12-month Dollar-Cost Averaging strategy for many windows at
+    once, investing on the last trading day of each month"""
+    month_ends = panel.calendar.month_ends
+    months = panel.calendar.next_month_end(starts)[:, None] + np.arange(
+        DCA_MONTHS)
+    in_range = months < len(month_ends)
+    months = np.minimum(months, len(month_ends) - 1)
+    invested = in_range & (month_ends[months] <= ends[:, None])
 
-    return total_shares * prices.loc[end_date]
+    total_shares = np.where(
+        invested, config['monthly_investment'] / panel.end_prices[months], 0
+    ).sum(axis=1)
+    return total_shares * prices[ends]
+
+
+def load_prices(config: Dict):
+    """Scaled prices, their monthly panel and the investment windows of a
+    config"""
+    scaled_prices = load_scaled_config_prices(
+        config['stock_id'], config, config['annual_return'])
+
+    calendar = TradingCalendar(scaled_prices.index)
+    starts, ends = calendar.windows(config['investment_period_years'] * 365)
+    prices = scaled_prices.to_numpy()
+    return prices, MonthlyPanel(prices, calendar), starts, ends
 
 
 def run_simulation(config: Dict) -> pd.DataFrame:
     """Run simulation across all historical periods"""
-    raw_data = download_stock_data(config['stock_id'])
-    scaled_prices = scale_price_data(raw_data, 1 + config['annual_return'])
+    prices, panel, starts, ends = load_prices(config)
 
-    investment_days = config['investment_period_years'] * 365
     windows = pd.DataFrame({
-        'Start Date': scaled_prices.index[:-investment_days],
-        'End Date': scaled_prices.index[investment_days:]
+        'Start Date': panel.calendar.index[starts],
+        'End Date': panel.calendar.index[ends]
     })
+    windows['Lump Sum'] = simulate_lump_sum(prices, starts, ends, config)
+    windows['DCA'] = simulate_dca(prices, panel, starts, ends, config)
+
+    return windows.dropna()
+
+
+def iter_simulation(config: Dict, chunk_size: int = 4096
+                    ) -> Iterator[pd.DataFrame]:
+    """Chunked variant of run_simulation yielding the window table in
+    pieces of chunk_size windows (e.g. for result_store.export_results)"""
+    prices, panel, starts, ends = load_prices(config)
+
+    for chunk in chunk_slices(len(starts), chunk_size):
+        windows = pd.DataFrame({
+            'Start Date': panel.calendar.index[starts[chunk]],
+            'End Date': panel.calendar.index[ends[chunk]],
+            'Lump Sum': simulate_lump_sum(prices, starts[chunk],
+                                          ends[chunk], config),
+            'DCA': simulate_dca(prices, panel, starts[chunk], ends[chunk],
+                                config)
+        })
+        yield windows.dropna()
+
+
+def summarize_simulation(config: Dict, bin_edges: np.ndarray = None,
+                         chunk_size: int = 4096) -> Dict[
+    str, StreamingSummary]:
+    """
+    Streaming variant of run_simulation: reduce all windows chunk by chunk
+    into mergeable summaries instead of building the per-window table.
 
-    windows['Lump Sum'] = windows.apply(
-        lambda row: simulate_lump_sum(scaled_prices, row['Start Date'],
-                                      row['End Date'], config), axis=1)
+    Returns:
+    Dict[str, StreamingSummary]: Summaries of 'Lump Sum' and 'DCA'.
+    """
+    prices, panel, starts, ends = load_prices(config)
+    bin_edges = log_bins() if bin_edges is None else bin_edges
+    summaries = {'Lump Sum': StreamingSummary(bin_edges),
+                 'DCA': StreamingSummary(bin_edges)}
 
-    windows['DCA'] = windows.apply(
-        lambda row: simulate_dca(scaled_prices, row['Start Date'],
-                                 row['End Date'], config), axis=1)
+    for chunk in chunk_slices(len(starts), chunk_size):
+        summaries['Lump Sum'].update(
+            simulate_lump_sum(prices, starts[chunk], ends[chunk], config))
+        summaries['DCA'].update(
+            simulate_dca(prices, panel, starts[chunk], ends[chunk],
+                         config))
 
-    return windows.dropna()
\ No newline at end of file
+    return summaries
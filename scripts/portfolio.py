@@ -0,0 +1,105 @@
+"""
+Summary: Multi-asset portfolios with monthly rebalancing.
+
+A weight vector over several tickers is turned into a single rebalanced
+portfolio price index, so the single-asset cores can evaluate portfolios
+unchanged. Many allocations are evaluated at once as an
+(allocations x trading days) index matrix.
+"""
+
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Union
+from scripts.price_data import load_scaled_config_prices, load_raw_prices
+from scripts.trading_calendar import TradingCalendar
+
+
+def as_stock_ids(config: Dict) -> List[str]:
+    """Tickers of a config, 'stock_id' may be a single ticker or a list"""
+    stock_ids = config['stock_id']
+    return [stock_ids] if isinstance(stock_ids, str) else list(stock_ids)
+
+
+def load_scaled_prices(config: Dict,
+                       annual_management_fee: float = 0) -> pd.DataFrame:
+    """
+    Download and scale the prices of all tickers of a config.
+
+    'annual_return' may be a single rate for all tickers or a list with one
+    rate per ticker (None keeps the historical return). The nominal prices
+    are scaled first and then adjusted by the optional 'cpi' and 'fx'
+    config keys (see scripts.price_data.load_scaled_config_prices).
+    The series are aligned on their common trading days.
+
+    Returns:
+    pd.DataFrame: One column of scaled prices per ticker.
+    """
+    stock_ids = as_stock_ids(config)
+    load_raw_prices(stock_ids)  # Fetch all tickers concurrently
+    annual_returns = np.broadcast_to(config['annual_return'],
+                                     (len(stock_ids),))
+    scaled = {}
+    for stock_id, annual_return in zip(stock_ids, annual_returns):
+        scaled[stock_id] = load_scaled_config_prices(
+            stock_id, config, annual_return, annual_management_fee)
+    return pd.concat(scaled, axis=1, join='inner')
+
+
+def normalize_weights(weights: Union[List, np.ndarray],
+                      num_assets: int) -> np.ndarray:
+    """Validate weights (one allocation per row) and scale rows to sum 1"""
+    weights = np.atleast_2d(np.asarray(weights, dtype=float))
+    if weights.shape[1] != num_assets:
+        raise ValueError(
+            f"Expected {num_assets} weights per allocation, "
+            f"got {weights.shape[1]}")
+    if (weights < 0).any() or (weights.sum(axis=1) <= 0).any():
+        raise ValueError("Weights must be non-negative and not all zero")
+    return weights / weights.sum(axis=1, keepdims=True)
+
+
+def rebalanced_portfolio_prices(prices: np.ndarray,
+                                calendar: TradingCalendar,
+                                weights: np.ndarray) -> np.ndarray:
+    """
+    Price index of portfolios rebalanced on the first trading day of each
+    month. Between rebalancing dates the asset weights drift with prices.
+
+    Parameters:
+    prices (np.ndarray): Asset prices, shape (trading days, assets).
+    calendar (TradingCalendar): Calendar of the trading days.
+    weights (np.ndarray): Allocations, shape (allocations, assets).
+
+    Returns:
+    np.ndarray: Portfolio index starting at 1, shape (allocations,
+    trading days).
+    """
+    month_starts = calendar.month_starts
+    month_growth = prices[month_starts[1:]] / prices[month_starts[:-1]]
+    index_at_month_start = np.cumprod(
+        np.hstack((np.ones((len(weights), 1)), weights @ month_growth.T)),
+        axis=1)
+
+    # Every day is valued against the rebalancing date before it; a month
+    # start is valued against the previous month start
+    is_month_start = np.zeros(len(calendar), dtype=bool)
+    is_month_start[month_starts] = True
+    anchor_month = np.maximum(calendar.month_of_day - is_month_start, 0)
+    relative = prices / prices[month_starts[anchor_month]]
+    return index_at_month_start[:, anchor_month] * (weights @ relative.T)
+
+
+def load_portfolio_prices(config: Dict, weights,
+                          annual_management_fee: float = 0):
+    """
+    Scaled, rebalanced portfolio index for all allocations of a config.
+
+    Returns:
+    Tuple[np.ndarray, TradingCalendar]: Index of shape (allocations,
+    trading days) and its calendar.
+    """
+    scaled_prices = load_scaled_prices(config, annual_management_fee)
+    calendar = TradingCalendar(scaled_prices.index)
+    weights = normalize_weights(weights, scaled_prices.shape[1])
+    return rebalanced_portfolio_prices(scaled_prices.to_numpy(), calendar,
+                                       weights), calendar
@@ -1,8 +1,10 @@
 """Core functionality for portfolio optimization"""
 import numpy as np
 import pandas as pd
-import yfinance as yf
+from concurrent.futures import ProcessPoolExecutor
 from typing import List, Tuple
+from scripts.utils import Seed, spawn_seeds
+from scripts.data_providers import fetch_prices
 
 
 def download_asset_data(assets: List[str], start_date: str,
@@ -14,14 +16,14 @@ def download_asset_data(assets: List[str], start_date: str,
     start_dt = pd.to_datetime(start_date)
     end_dt = pd.to_datetime(end_date)
 
-    # Download data
-    data = yf.download(assets, start=start_date, end=end_date)[
-        "Close"].dropna()
+    # Download data, all assets concurrently
+    data = pd.concat(fetch_prices(assets, start_date, end_date),
+                     axis=1).dropna()
 
     # Check if any data exists in requested range
     if data.empty:
         # Check maximum available history
-        full_data = yf.download(assets, period="max")["Close"].dropna()
+        full_data = pd.concat(fetch_prices(assets), axis=1).dropna()
 
         if full_data.empty:
             raise ValueError(
@@ -56,43 +58,64 @@ def calculate_metrics(prices: pd.DataFrame) -> Tuple[pd.Series, pd.DataFrame]:
     return mean_returns, cov_matrix
 
 
+def generate_portfolio_block(seed: np.random.SeedSequence,
+                             num_portfolios: int,
+                             mean_returns: np.ndarray,
+                             cov_matrix: np.ndarray,
+                             risk_free_rate: float) -> Tuple[
+    np.ndarray, np.ndarray]:
+    """Generate one block of random portfolios from its own random stream"""
+    rng = np.random.default_rng(seed)
+    weights = rng.random((num_portfolios, len(mean_returns)))
+    weights /= weights.sum(axis=1, keepdims=True)
+
+    ret = weights @ mean_returns
+    risk = np.sqrt(np.einsum('ij,jk,ik->i', weights, cov_matrix, weights))
+    sharpe = (ret - risk_free_rate) / risk
+    return np.vstack((ret, risk, sharpe)), weights
+
+
 def generate_portfolios(num_portfolios: int,
                         mean_returns: pd.Series,
                         cov_matrix: pd.DataFrame,
-                        risk_free_rate: float) -> Tuple[
-    np.ndarray, List[np.ndarray]]:
-    """Generate random portfolios with performance metrics"""
-    num_assets = len(mean_returns)
-    results = np.zeros((3, num_portfolios))
-    weights_list = []
-
-    for i in range(num_portfolios):
-        weights = np.random.random(num_assets)
-        weights /= weights.sum()
-        ret, risk, sharpe = portfolio_performance(weights, mean_returns,
-                                                  cov_matrix, risk_free_rate)
-
-        results[0, i] = ret
-        results[1, i] = risk
-        results[2, i] = sharpe
-        weights_list.append(weights)
-
-    return results, weights_list
-
-
-def portfolio_performance(weights: np.ndarray,
-                          mean_returns: pd.Series,
-                          cov_matrix: pd.DataFrame,
-                          risk_free_rate: float) -> Tuple[float, float, float]:
-    """Calculate portfolio return, risk, and Sharpe ratio"""
-    ret = np.dot(weights, mean_returns)
-    risk = np.sqrt(np.dot(weights.T, np.dot(cov_matrix, weights)))
-    sharpe = (ret - risk_free_rate) / risk
-    return ret, risk, sharpe
+                        risk_free_rate: float,
+                        seed: Seed = None,
+                        block_size: int = 100000,
+                        workers: int = 1) -> Tuple[
+    np.ndarray, np.ndarray]:
+    """
+    Generate random portfolios with performance metrics.
+
+    The portfolios are drawn in blocks of block_size, each from its own
+    stream spawned from seed. For a given seed the result is bit-for-bit
+    identical for any number of workers (processes).
+
+    Returns:
+    Tuple[np.ndarray, np.ndarray]: Return, risk and Sharpe ratio of shape
+    (3, num_portfolios) and the weights, one row per portfolio.
+    """
+    num_blocks = -(-num_portfolios // block_size)
+    block_args = [
+        (block_seed, min(block_size, num_portfolios - i * block_size),
+         np.asarray(mean_returns), np.asarray(cov_matrix), risk_free_rate)
+        for i, block_seed in enumerate(spawn_seeds(seed, num_blocks))
+    ]
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            blocks = list(executor.map(generate_portfolio_block,
+                                       *zip(*block_args)))
+    else:
+        blocks = [generate_portfolio_block(*args) for args in block_args]
+
+    if not blocks:
+        return np.zeros((3, 0)), np.zeros((0, len(mean_returns)))
+    results, weights = zip(*blocks)
+    return np.hstack(results), np.vstack(weights)
 
 
 def find_optimal_portfolios(results: np.ndarray,
-                            weights_list: List[np.ndarray],
+                            weights_list: np.ndarray,
                             mean_returns: pd.Series,
                             cov_matrix: pd.DataFrame,
                             risk_free_rate: float) -> dict:
@@ -120,12 +143,15 @@ def run_optimization(assets: List[str],
                      start_date: str,
                      end_date: str,
                      num_portfolios: int = 10000,
-                     risk_free_rate: float = 0.02) -> dict:
-    """Main optimization workflow"""
+                     risk_free_rate: float = 0.02,
+                     seed: Seed = None,
+                     workers: int = 1) -> dict:
+    """Main optimization workflow, reproducible for a given seed"""
     prices = download_asset_data(assets, start_date, end_date)
     mean_returns, cov_matrix = calculate_metrics(prices)
     results, weights = generate_portfolios(num_portfolios, mean_returns,
-                                           cov_matrix, risk_free_rate)
+                                           cov_matrix, risk_free_rate,
+                                           seed=seed, workers=workers)
     portfolios = find_optimal_portfolios(results, weights, mean_returns,
                                          cov_matrix, risk_free_rate)
 
@@ -0,0 +1,110 @@
+"""
+Summary: Cached price loading with inflation and currency adjustment.
+
+Price series can be converted into another currency with an FX series and
+deflated with a CPI series. Both are read from local files (CSV or
+Parquet, first column = values, index = dates) or downloaded like prices,
+aligned once to the trading days of the price series with a vectorized
+as-of join and cached as adjustment factors, so adjusted runs cost no more
+than nominal ones. The cores load their prices with
+load_scaled_config_prices, which scales the nominal prices to the target
+return before applying the factors, so the adjustment is not undone by the
+scaling.
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from functools import lru_cache
+from typing import Dict, List, Optional
+from scripts.utils import history_range, scale_price_data, \
+    target_growth
+from scripts.trading_calendar import to_day_numbers
+from scripts.data_providers import DataProvider, get_provider, \
+    fetch_prices, read_series_file
+
+# Raw closing prices per (provider, ticker)
+_raw_prices: Dict = {}
+
+
+def load_raw_prices(stock_ids: List[str]) -> Dict[str, pd.Series]:
+    """Closing prices of several tickers. Tickers not cached yet are
+    fetched concurrently from the current provider"""
+    provider = get_provider()
+    missing = [stock_id for stock_id in dict.fromkeys(stock_ids)
+               if (provider, stock_id) not in _raw_prices]
+    if missing:
+        fetched = fetch_prices(missing, *history_range(), provider=provider)
+        for stock_id, series in fetched.items():
+            _raw_prices[provider, stock_id] = series
+    return {stock_id: _raw_prices[provider, stock_id]
+            for stock_id in stock_ids}
+
+
+def read_series(source: str) -> pd.Series:
+    """Read a series from a local CSV / Parquet file or load it as ticker
+    (e.g. an FX rate like 'USDEUR=X')"""
+    if os.path.isfile(source):
+        return read_series_file(source)
+    return load_raw_prices([source])[source]
+
+
+def align_asof(series: pd.Series, index: pd.DatetimeIndex) -> np.ndarray:
+    """Last value of series on or before every date of index, NaN before
+    the first observation"""
+    positions = np.searchsorted(to_day_numbers(series.index),
+                                to_day_numbers(index), side='right') - 1
+    values = series.to_numpy()[np.maximum(positions, 0)]
+    return np.where(positions >= 0, values, np.nan)
+
+
+def adjustment_factors(stock_id: str, cpi: Optional[str] = None,
+                       fx: Optional[str] = None) -> pd.Series:
+    """
+    Factors converting the prices of a ticker into adjusted prices. Results
+    are cached per argument combination and must not be modified in place.
+
+    Parameters:
+    stock_id (str): Ticker of the prices.
+    cpi (str): Optional CPI series; prices are deflated to the money value
+    of the last CPI observation (real terms).
+    fx (str): Optional FX series in units of the target currency per unit
+    of the price currency; prices are converted into the target currency.
+
+    Returns:
+    pd.Series: Factors on the trading days covered by all series.
+    """
+    return _adjustment_factors(get_provider(), stock_id, cpi, fx)
+
+
+@lru_cache(maxsize=None)
+def _adjustment_factors(provider: DataProvider, stock_id: str,
+                        cpi: Optional[str], fx: Optional[str]) -> pd.Series:
+    """Cached implementation of adjustment_factors per provider"""
+    index = load_raw_prices([stock_id])[stock_id].index
+    factors = np.ones(len(index))
+    if fx is not None:
+        factors = factors * align_asof(read_series(fx), index)
+    if cpi is not None:
+        cpi_values = read_series(cpi)
+        factors = factors * cpi_values.iloc[-1] / align_asof(cpi_values,
+                                                            index)
+    return pd.Series(factors, index=index, name=stock_id).dropna()
+
+
+def load_scaled_config_prices(stock_id: str, config: Dict, annual_return,
+                              annual_management_fee: float = 0
+                              ) -> pd.Series:
+    """
+    Prices of a ticker scaled to annual_return (see target_growth) and then
+    adjusted by the optional config keys 'cpi' and 'fx'. annual_return is
+    the nominal return in the price currency, so inflation and currency
+    moves still change the growth of the adjusted prices. Only the trading
+    days covered by the adjustment series are used.
+    """
+    factors = adjustment_factors(stock_id, config.get('cpi'),
+                                 config.get('fx'))
+    prices = load_raw_prices([stock_id])[stock_id].loc[factors.index]
+    scaled = scale_price_data(
+        prices, target_growth(prices, annual_return, annual_management_fee))
+    return scaled * factors
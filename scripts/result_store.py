@@ -0,0 +1,255 @@
+"""
+Summary: Out-of-core storage of per-window results as a Parquet dataset.
+
+Window results are streamed chunk by chunk into a hive-partitioned dataset
+<root>/study=<study>/ticker=<tickers>/config_hash=<hash>/part-0.parquet,
+one row group per chunk; exporting a partition again replaces its
+results. Dates are stored as int32 day offsets (days since 1970-01-01)
+and floats as float32, so sweep-scale outputs stay compact.
+The configs are kept as JSON in <root>/_configs/<hash>.json. The reader
+pushes partition and date filters down to the files, so queries only read
+the matching row groups. Each study has its own columns, so datasets are
+read per study. Requires the optional dependency pyarrow.
+"""
+
+import hashlib
+import json
+import os
+import uuid
+from urllib.parse import quote
+import numpy as np
+import pandas as pd
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, \
+    Union
+from scripts.portfolio import as_stock_ids
+from scripts.trading_calendar import to_day_numbers
+
+# Schema metadata key listing the columns stored as day offsets
+DAY_COLUMNS_KEY = b'day_columns'
+CONFIG_DIRECTORY = '_configs'
+# File holding the results of a partition
+RESULT_FILE = 'part-0.parquet'
+
+
+def study_directory(root: str, study: str) -> str:
+    """Directory of the results of a study within the dataset"""
+    return os.path.join(root, f'study={quote(study, safe="")}')
+
+
+def config_hash(config: Dict) -> str:
+    """Stable short hash of a config, independent of the key order"""
+    encoded = json.dumps(config, sort_keys=True, default=str)
+    return hashlib.sha1(encoded.encode()).hexdigest()[:16]
+
+
+def encode_results(results: pd.DataFrame) -> Tuple[pd.DataFrame,
+                                                   List[str]]:
+    """
+    Compact copy of a result table: dates become int32 day offsets and
+    floats become float32. A named index is stored as a column.
+
+    Returns:
+    Tuple[pd.DataFrame, List[str]]: The encoded table and the names of its
+    day offset columns.
+    """
+    if results.index.name is not None:
+        results = results.reset_index()
+    encoded = {}
+    day_columns = []
+    for name, values in results.items():
+        if pd.api.types.is_datetime64_any_dtype(values):
+            encoded[str(name)] = to_day_numbers(values).astype(np.int32)
+            day_columns.append(str(name))
+        elif pd.api.types.is_float_dtype(values):
+            encoded[str(name)] = values.to_numpy(dtype=np.float32)
+        else:
+            encoded[str(name)] = values.to_numpy()
+    return pd.DataFrame(encoded), day_columns
+
+
+def decode_days(frame: pd.DataFrame, day_columns: List[str]) -> pd.DataFrame:
+    """Convert day offset columns back to dates (in place)"""
+    for name in day_columns:
+        if name in frame:
+            frame[name] = pd.to_datetime(frame[name].astype(np.int64),
+                                         unit='D')
+    return frame
+
+
+class ResultWriter:
+    """
+    Streams result tables of one (study, tickers, config) into their
+    partition of the dataset. Use as context manager or call close. The
+    tables are written to a hidden temporary file, which replaces the
+    results of the partition on close, so reruns do not duplicate rows and
+    a failed export keeps the previous results.
+
+    Parameters:
+    root (str): Directory of the dataset.
+    study (str): Study name, e.g. 'savings_plan'.
+    config (Dict): Config of the results; its tickers and hash select the
+    partition.
+    """
+
+    def __init__(self, root: str, study: str, config: Dict):
+        self.root = root
+        self.config_hash = config_hash(config)
+        tickers = ','.join(as_stock_ids(config))
+        self.directory = os.path.join(
+            study_directory(root, study),
+            f'ticker={quote(tickers, safe="")}',
+            f'config_hash={self.config_hash}')
+        os.makedirs(self.directory, exist_ok=True)
+        config_directory = os.path.join(root, CONFIG_DIRECTORY)
+        os.makedirs(config_directory, exist_ok=True)
+        with open(os.path.join(config_directory,
+                               f'{self.config_hash}.json'), 'w') as file:
+            json.dump(config, file, sort_keys=True, indent=2, default=str)
+        self.path = os.path.join(self.directory, RESULT_FILE)
+        self._temporary_path = os.path.join(
+            self.directory, f'.{uuid.uuid4().hex}.parquet.tmp')
+        self.num_rows = 0
+        self._writer = None
+
+    def write(self, results: pd.DataFrame):
+        """Append a result table as one row group"""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        encoded, day_columns = encode_results(results)
+        table = pa.Table.from_pandas(encoded, preserve_index=False)
+        table = table.replace_schema_metadata({
+            **(table.schema.metadata or {}),
+            DAY_COLUMNS_KEY: json.dumps(day_columns).encode()})
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self._temporary_path,
+                                            table.schema)
+        self._writer.write_table(table)
+        self.num_rows += table.num_rows
+
+    def close(self):
+        """Finish the Parquet file and replace the previous results of the
+        partition with it"""
+        if self._writer is None:
+            return
+        self._writer.close()
+        self._writer = None
+        for name in os.listdir(self.directory):
+            if name.endswith('.parquet'):
+                os.remove(os.path.join(self.directory, name))
+        os.replace(self._temporary_path, self.path)
+
+    def discard(self):
+        """Drop the written tables and keep the previous results"""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            os.remove(self._temporary_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+def export_results(root: str, study: str, config: Dict,
+                   chunks: Iterable[pd.DataFrame]) -> str:
+    """
+    Stream result chunks (e.g. from the iter_simulation functions of the
+    cores) into the dataset without holding them in memory.
+
+    Returns:
+    str: The config hash of the written partition.
+    """
+    with ResultWriter(root, study, config) as writer:
+        for chunk in chunks:
+            writer.write(chunk)
+    return writer.config_hash
+
+
+def open_results(root: str, study: str):
+    """The results of a study as lazy pyarrow.dataset.Dataset, with the
+    partition columns ticker and config_hash"""
+    import pyarrow.dataset as ds
+    return ds.dataset(study_directory(root, study), format='parquet',
+                      partitioning='hive')
+
+
+def results_filter(ticker: Optional[str] = None,
+                   config: Union[Dict, str, None] = None,
+                   start: Optional[str] = None, end: Optional[str] = None,
+                   date_column: str = 'Start Date'):
+    """
+    Filter expression on the partitions and a date range [start, end) of
+    date_column. config is a config dict or its hash.
+    """
+    import pyarrow.dataset as ds
+
+    conditions = []
+    if ticker is not None:
+        conditions.append(ds.field('ticker') == ticker)
+    if config is not None:
+        hash_value = config if isinstance(config, str) \
+            else config_hash(config)
+        conditions.append(ds.field('config_hash') == hash_value)
+    if start is not None:
+        conditions.append(ds.field(date_column) >=
+                          int(to_day_numbers([start])[0]))
+    if end is not None:
+        conditions.append(ds.field(date_column) <
+                          int(to_day_numbers([end])[0]))
+
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None \
+            else expression & condition
+    return expression
+
+
+def dataset_day_columns(dataset) -> List[str]:
+    """Columns of a dataset stored as day offsets"""
+    metadata = dataset.schema.metadata or {}
+    return json.loads(metadata.get(DAY_COLUMNS_KEY, b'[]'))
+
+
+def read_results(root: str, study: str, columns: Optional[List[str]] = None,
+                 decode_dates: bool = True, **filters) -> pd.DataFrame:
+    """
+    Read the matching results of a study. Only the requested columns
+    and the row groups and partitions passing the filters are loaded.
+
+    Parameters:
+    columns (List[str]): Columns to load, all by default.
+    decode_dates (bool): Convert day offsets back to dates.
+    filters: Keyword arguments of results_filter.
+    """
+    dataset = open_results(root, study)
+    frame = dataset.to_table(columns=columns,
+                             filter=results_filter(**filters)).to_pandas()
+    return decode_days(frame, dataset_day_columns(dataset)) \
+        if decode_dates else frame
+
+
+def iter_results(root: str, study: str, columns: Optional[List[str]] = None,
+                 decode_dates: bool = True, batch_size: int = 131072,
+                 **filters) -> Iterator[pd.DataFrame]:
+    """Like read_results, but yield the matching rows in batches of at
+    most batch_size rows, for reductions over results larger than memory"""
+    dataset = open_results(root, study)
+    day_columns = dataset_day_columns(dataset)
+    for batch in dataset.to_batches(columns=columns,
+                                    filter=results_filter(**filters),
+                                    batch_size=batch_size):
+        frame = batch.to_pandas()
+        yield decode_days(frame, day_columns) if decode_dates else frame
+
+
+def load_result_config(root: str, hash_value: str) -> Dict:
+    """The config stored for a config hash"""
+    with open(os.path.join(root, CONFIG_DIRECTORY,
+                           f'{hash_value}.json')) as file:
+        return json.load(file)
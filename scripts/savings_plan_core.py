@@ -2,82 +2,173 @@
 
 import pandas as pd
 import numpy as np
-from typing import Dict
-from scripts.utils import scale_price_data, download_stock_data
+from typing import Dict, Iterator
+from scripts.portfolio import as_stock_ids, load_portfolio_prices
+from scripts.trading_calendar import MonthlyPanel
+from scripts.streaming_stats import StreamingSummary, log_bins, chunk_slices
 
 
-def precalculate_investment_dates(start, end, interval):
-    """Pre-calculate all possible investment dates upfront"""
-    dates = pd.date_range(start=start, end=end, freq=f'{interval}MS')
-    return dates[(dates >= start) & (dates <= end)]
+def strided_cumsum(values: np.ndarray, stride: int) -> np.ndarray:
+    """Cumulative sums along the last axis over every stride-th element,
+    i.e. result[k] = values[k] + values[k - stride] + ..."""
+    num_values = values.shape[-1]
+    padded = -(-num_values // stride) * stride
+    values = np.concatenate(
+        (values, np.zeros(values.shape[:-1] + (padded - num_values,))),
+        axis=-1)
+    blocks = values.reshape(values.shape[:-1] + (padded // stride, stride))
+    return np.cumsum(blocks, axis=-2).reshape(
+        values.shape[:-1] + (padded,))[..., :num_values]
 
 
 # Optimized simulate_savings
-def simulate_savings(prices, start_date, end_date, config):
-    """Simulate the savings plan for a specific period based on historical
-    stock data"""
-    iv_dates = precalculate_investment_dates(start_date, end_date,
-                                             config['saving_interval'])
-
-    if not iv_dates.empty:
-        effective_rates = calculate_effective_rates(config, len(iv_dates))
-        shares = effective_rates / prices.loc[iv_dates].values
-        total_shares = shares.sum()
-    else:
-        total_shares = 0
-
-    initial_shares = config['initial_investment'] / prices.loc[start_date]
-    return (total_shares + initial_shares) * prices.loc[end_date]
+def simulate_savings(prices: np.ndarray, panel: MonthlyPanel,
+                     starts: np.ndarray, ends: np.ndarray,
+                     config: Dict) -> np.ndarray:
+    """
+    Simulate the savings plan for many windows at once. Savings are invested
+    on the first trading day of every saving_interval-th month.
+
+    Parameters:
+    prices (np.ndarray): Prices of shape (trading days,) or (allocations,
+    trading days).
+    panel (MonthlyPanel): Monthly panel of the prices, the investments
+    only use its month-start prices.
+    starts, ends (np.ndarray): Window start and end positions.
+
+    Returns:
+    np.ndarray: Final values of shape (windows,) or (allocations, windows).
+    """
+    interval = config['saving_interval']
+    calendar = panel.calendar
+    month_starts = calendar.month_starts
+    inverse_prices = 1 / panel.start_prices
+    cumulative = strided_cumsum(inverse_prices, interval)
+
+    # Investment months of window w: first[w], first[w] + interval, ...
+    first = calendar.next_month_start(starts)
+    last_possible = np.searchsorted(month_starts, ends, side='right') - 1
+    num_periods = np.maximum((last_possible - first) // interval + 1, 0)
+    has_periods = num_periods > 0
+    first_idx = np.minimum(first, len(month_starts) - 1)
+    last_idx = np.where(has_periods, first + (num_periods - 1) * interval, 0)
+    before_first = np.where(first >= interval,
+                            cumulative[..., np.maximum(first - interval, 0)],
+                            0)
+    period_sums = np.where(has_periods,
+                           cumulative[..., last_idx] - before_first, 0)
+
+    total_shares = np.zeros_like(period_sums)
+    max_periods = num_periods.max(initial=0)
+    if max_periods:
+        effective_rates = np.broadcast_to(
+            calculate_effective_rates(config, max_periods), (max_periods,))
+        steady_rate = effective_rates[-1]
+        total_shares = steady_rate * period_sums
+        # Periods before the closing fee is paid off get their own rate
+        for period in np.flatnonzero(effective_rates != steady_rate):
+            idx = np.minimum(first_idx + period * interval,
+                             len(month_starts) - 1)
+            total_shares += np.where(
+                period < num_periods,
+                (effective_rates[period] - steady_rate) *
+                inverse_prices[..., idx], 0)
+
+    initial_shares = config['initial_investment'] / prices[..., starts]
+    return (total_shares + initial_shares) * prices[..., ends]
 
 
 def calculate_effective_rates(config, num_periods):
-    """Calculate the effective saving rates for each period"""
+    """Calculate the effective saving rates for each period. A share
+    'closing_fee_rate' of every saving pays the closing fee until
+    'closing_fee_total' is reached"""
     base_rate = config['saving_rate'] - config['order_fee']
 
     if config['closing_fee_total'] > 0:
-        closing_fees = np.minimum(
-            np.cumsum(config['saving_rate'] * config['closing_fee_rate']),
+        paid_fees = np.minimum(
+            np.cumsum(np.full(num_periods, config['saving_rate'] *
+                              config['closing_fee_rate'])),
             config['closing_fee_total']
         )
-        return base_rate - closing_fees
+        return base_rate - np.diff(paid_fees, prepend=0)
     else:
         return np.full(num_periods, base_rate)
 
 
+def run_allocation_sweep(config: Dict, allocations) -> pd.DataFrame:
+    """
+    Simulate the savings plan for several allocations over 'stock_id' (a
+    list of tickers) in one vectorized pass over all investment windows.
+
+    Returns:
+    pd.DataFrame: Final values, one row per window (indexed by start date)
+    and one column per allocation.
+    """
+    prices, calendar = load_portfolio_prices(
+        config, allocations, config['annual_management_fee'])
+    starts, ends = calendar.windows(config['investment_period_years'] * 365)
+    final_values = simulate_savings(prices, MonthlyPanel(prices, calendar),
+                                    starts, ends, config)
+    return pd.DataFrame(final_values.T,
+                        index=pd.Index(calendar.index[starts],
+                                       name='Start Date'))
+
+
+def load_prices(config: Dict):
+    """Scaled portfolio prices, their monthly panel and the investment
+    windows of a config"""
+    weights = config.get('weights', [1] * len(as_stock_ids(config)))
+    prices, calendar = load_portfolio_prices(
+        config, weights, config['annual_management_fee'])
+    starts, ends = calendar.windows(config['investment_period_years'] * 365)
+    return prices[0], MonthlyPanel(prices[0], calendar), starts, ends
+
+
 def run_simulation(config: Dict) -> pd.DataFrame:
-    """Simulate the savings plan for all possible investment windows"""
-    stock_data = download_stock_data(config['stock_id'])
-    scaled_prices = scale_price_data(stock_data,
-                                           1 + config['annual_return'] -
-                                           config['annual_management_fee'])
+    """Simulate the savings plan for all possible investment windows.
+    Several tickers are held with the optional config 'weights'"""
+    prices, panel, starts, ends = load_prices(config)
 
-    investment_days = config['investment_period_years'] * 365
     windows = pd.DataFrame({
-        'Start Date': scaled_prices.index[:-investment_days],
-        'End Date': scaled_prices.index[investment_days:]
+        'Start Date': panel.calendar.index[starts],
+        'End Date': panel.calendar.index[ends]
     })
-
-    # Vectorized calculation
-    windows['Final Value'] = windows.apply(
-        lambda row: calculate_window_value(
-            scaled_prices,
-            row['Start Date'],
-            row['End Date'],
-            config
-        ), axis=1
-    )
+    windows['Final Value'] = simulate_savings(prices, panel, starts, ends,
+                                              config)
 
     return windows
 
 
-def calculate_window_value(prices, start_date, end_date, config):
-    """Helper function for vectorized calculation"""
-    try:
-        return simulate_savings(
-            prices=prices,
-            start_date=start_date,
-            end_date=end_date,
-            config=config
-        )
-    except KeyError:
-        return np.nan
\ No newline at end of file
+def iter_simulation(config: Dict, chunk_size: int = 4096
+                    ) -> Iterator[pd.DataFrame]:
+    """Chunked variant of run_simulation yielding the window table in
+    pieces of chunk_size windows (e.g. for result_store.export_results)"""
+    prices, panel, starts, ends = load_prices(config)
+
+    for chunk in chunk_slices(len(starts), chunk_size):
+        yield pd.DataFrame({
+            'Start Date': panel.calendar.index[starts[chunk]],
+            'End Date': panel.calendar.index[ends[chunk]],
+            'Final Value': simulate_savings(prices, panel, starts[chunk],
+                                            ends[chunk], config)
+        })
+
+
+def summarize_simulation(config: Dict, bin_edges: np.ndarray = None,
+                         chunk_size: int = 4096) -> StreamingSummary:
+    """
+    Streaming variant of run_simulation: reduce all windows chunk by chunk
+    into a mergeable summary instead of building the per-window table.
+    Windows ending below the invested amount count as failures.
+    """
+    prices, panel, starts, ends = load_prices(config)
+    invested = config['initial_investment'] + config['saving_rate'] * (
+            12 / config['saving_interval']) * config['investment_period_years']
+    summary = StreamingSummary(log_bins() if bin_edges is None else bin_edges)
+
+    for chunk in chunk_slices(len(starts), chunk_size):
+        final_values = simulate_savings(prices, panel, starts[chunk],
+                                        ends[chunk], config)
+        summary.update(final_values, failed=final_values < invested)
+
+    return summary
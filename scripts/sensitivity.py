@@ -0,0 +1,204 @@
+"""
+Summary: Sensitivity of study results to their CONFIG parameters.
+
+The base case and all one-at-a-time perturbations are evaluated in one
+batched pass over a shared window index: perturbations that change the
+price scaling are stacked as rows of a price matrix, all other parameters
+become per-row arrays. The savings plan is linear in its initial
+investment and saving rate, so those are evaluated analytically from
+precomputed share-accumulation sums.
+"""
+
+import numpy as np
+import pandas as pd
+from typing import Dict, Iterable, List, Tuple
+from scripts.portfolio import as_stock_ids, load_portfolio_prices
+from scripts.trading_calendar import MonthlyPanel
+from scripts.savings_plan_core import simulate_savings
+from scripts.withdrawal_plan_core import simulate_withdrawals, \
+    withdrawal_windows
+
+# Parameters changing the scaled prices
+PRICE_PARAMETERS = ('annual_return', 'annual_management_fee')
+SAVINGS_PARAMETERS = ('initial_investment', 'saving_rate', 'order_fee',
+                      'annual_return', 'annual_management_fee')
+WITHDRAWAL_PARAMETERS = ('monthly_withdrawal', 'initial_portfolio_value',
+                         'initial_portfolio_invested',
+                         'capital_gains_tax_rate', 'tax_free_threshold',
+                         'inflation', 'annual_return',
+                         'annual_management_fee')
+
+
+def perturbations(config: Dict, parameters: Iterable[str],
+                  supported: Tuple[str, ...], relative_step: float,
+                  absolute_step: float) -> List[Tuple[str, float, float]]:
+    """
+    One-at-a-time perturbations (parameter, base value, perturbed value).
+    Parameters are increased by relative_step, or by absolute_step if
+    their value is 0.
+    """
+    variants = []
+    for parameter in parameters:
+        if parameter not in supported:
+            raise ValueError(
+                f"Sensitivity of '{parameter}' is not supported, choose "
+                f"from: {', '.join(supported)}")
+        base = config[parameter]
+        if base is None or np.ndim(base):
+            raise ValueError(f"'{parameter}' must be a single number")
+        step = abs(base) * relative_step if base else absolute_step
+        variants.append((parameter, base, base + step))
+    return variants
+
+
+def stacked_prices(config: Dict, variants: List[Tuple[str, float, float]]):
+    """
+    Portfolio prices of the base case (row 0) and of every variant (row
+    i + 1). Only price parameters load differently scaled prices.
+
+    Returns:
+    Tuple[np.ndarray, TradingCalendar]: Prices of shape (variants + 1,
+    trading days) and their calendar.
+    """
+    weights = config.get('weights', [1] * len(as_stock_ids(config)))
+    base_prices, calendar = load_portfolio_prices(
+        config, weights, config['annual_management_fee'])
+    rows = [base_prices[0]]
+    for parameter, _, perturbed in variants:
+        if parameter in PRICE_PARAMETERS:
+            variant = dict(config, **{parameter: perturbed})
+            prices, _ = load_portfolio_prices(
+                variant, weights, variant['annual_management_fee'])
+            rows.append(prices[0])
+        else:
+            rows.append(base_prices[0])
+    return np.vstack(rows), calendar
+
+
+def variant_values(config: Dict, variants: List[Tuple[str, float, float]],
+                   parameter: str) -> np.ndarray:
+    """Value of a parameter for the base case and every variant, shaped
+    (variants + 1, 1) to broadcast against (rows, windows) results"""
+    values = [config[parameter]] + [
+        perturbed if name == parameter else config[parameter]
+        for name, _, perturbed in variants]
+    return np.asarray(values, dtype=float)[:, None]
+
+
+def tidy_sensitivities(variants: List[Tuple[str, float, float]],
+                       metrics: List[Dict[str, float]]) -> pd.DataFrame:
+    """
+    Table with one row per parameter and metric. Sensitivity is the change
+    of the metric per unit of the parameter, Elasticity the relative change
+    of the metric per relative change of the parameter.
+    """
+    rows = []
+    base_metrics = metrics[0]
+    for (parameter, base, perturbed), variant_metrics in zip(variants,
+                                                             metrics[1:]):
+        for metric, base_value in base_metrics.items():
+            value = variant_metrics[metric]
+            sensitivity = (value - base_value) / (perturbed - base)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                elasticity = np.float64(sensitivity) * base / base_value \
+                    if base else np.nan
+            rows.append({
+                'Parameter': parameter,
+                'Base Value': base,
+                'Perturbed Value': perturbed,
+                'Metric': metric,
+                'Base': base_value,
+                'Perturbed': value,
+                'Sensitivity': sensitivity,
+                'Elasticity': elasticity
+            })
+    return pd.DataFrame(rows)
+
+
+def savings_metrics(final_values: np.ndarray,
+                    invested: np.ndarray) -> List[Dict[str, float]]:
+    """Key metrics of the savings plan per row of final values"""
+    return [{
+        'Median Final Value': np.median(values),
+        'Mean Final Value': np.mean(values),
+        '1st Percentile Value': np.percentile(values, 1),
+        'Loss Rate': np.mean(values < row_invested)
+    } for values, row_invested in zip(final_values, invested[:, 0])]
+
+
+def savings_sensitivity(config: Dict,
+                        parameters: Iterable[str] = SAVINGS_PARAMETERS,
+                        relative_step: float = 0.01,
+                        absolute_step: float = 1e-4) -> pd.DataFrame:
+    """
+    Sensitivity of the savings plan metrics to one-at-a-time perturbations
+    of config parameters (see tidy_sensitivities for the table layout).
+
+    Final values are linear in the initial investment and the effective
+    saving rate: value = initial * A + (saving_rate - order_fee) * B, with
+    A and B computed once per price row. With a closing fee the effective
+    rate is not linear and the rows are simulated with their own configs.
+    """
+    variants = perturbations(config, parameters, SAVINGS_PARAMETERS,
+                             relative_step, absolute_step)
+    prices, calendar = stacked_prices(config, variants)
+    starts, ends = calendar.windows(config['investment_period_years'] * 365)
+    initial = variant_values(config, variants, 'initial_investment')
+    saving_rate = variant_values(config, variants, 'saving_rate')
+    order_fee = variant_values(config, variants, 'order_fee')
+
+    if config['closing_fee_total'] > 0:
+        final_values = np.vstack([
+            simulate_savings(row, MonthlyPanel(row, calendar), starts, ends,
+                             dict(config, initial_investment=row_initial,
+                                  saving_rate=row_rate, order_fee=row_fee))
+            for row, row_initial, row_rate, row_fee in zip(
+                prices, initial[:, 0], saving_rate[:, 0], order_fee[:, 0])])
+    else:
+        panel = MonthlyPanel(prices, calendar)
+        per_initial = simulate_savings(prices, panel, starts, ends, dict(
+            config, initial_investment=1, saving_rate=0, order_fee=0))
+        per_rate = simulate_savings(prices, panel, starts, ends, dict(
+            config, initial_investment=0, saving_rate=1, order_fee=0))
+        final_values = initial * per_initial + (
+                saving_rate - order_fee) * per_rate
+
+    invested = initial + saving_rate * (
+            12 / config['saving_interval']) * config['investment_period_years']
+    return tidy_sensitivities(variants,
+                              savings_metrics(final_values, invested))
+
+
+def withdrawal_sensitivity(config: Dict,
+                           parameters: Iterable[str] = WITHDRAWAL_PARAMETERS,
+                           relative_step: float = 0.01,
+                           absolute_step: float = 1e-4) -> pd.DataFrame:
+    """
+    Sensitivity of the withdrawal plan metrics to one-at-a-time
+    perturbations of config parameters (see tidy_sensitivities for the
+    table layout). All variants run in a single simulate_withdrawals call
+    with per-row parameter arrays, which requires the proportional cost
+    basis.
+    """
+    if config.get('cost_basis_method', 'proportional') != 'proportional':
+        raise ValueError("withdrawal_sensitivity requires "
+                         "'cost_basis_method': 'proportional'")
+    variants = perturbations(config, parameters, WITHDRAWAL_PARAMETERS,
+                             relative_step, absolute_step)
+    prices, calendar = stacked_prices(config, variants)
+    prices, _, step_grid, grid_years = withdrawal_windows(prices, calendar,
+                                                          config)
+    batched_config = dict(config, backend='numpy', **{
+        parameter: variant_values(config, variants, parameter)
+        for parameter in WITHDRAWAL_PARAMETERS
+        if parameter not in PRICE_PARAMETERS and parameter in config})
+    years_lasted = simulate_withdrawals(prices, step_grid, batched_config,
+                                        grid_years=grid_years)
+
+    target = config['withdrawal_period_years']
+    metrics = [{
+        'Failure Rate': np.mean(years < target),
+        'Median Years Lasted': np.median(years),
+        'Mean Years Lasted': np.mean(years)
+    } for years in years_lasted]
+    return tidy_sensitivities(variants, metrics)
@@ -0,0 +1,127 @@
+"""
+Summary: Mergeable streaming summary statistics for window results.
+
+A StreamingSummary is updated chunk by chunk and never stores the
+individual results: it keeps a fixed-bin histogram (for quantiles), running
+mean and variance, min/max and a failure count. Summaries of different
+chunks or processes with the same bins are combined with merge().
+"""
+
+import numpy as np
+from typing import Dict, Optional
+
+
+def log_bins(low: float = 1, high: float = 1e10,
+             num_bins: int = 4000) -> np.ndarray:
+    """Log-spaced bin edges, ~0.5% relative resolution with the defaults"""
+    return np.geomspace(low, high, num_bins + 1)
+
+
+def linear_bins(low: float, high: float, num_bins: int) -> np.ndarray:
+    """Evenly spaced bin edges"""
+    return np.linspace(low, high, num_bins + 1)
+
+
+class StreamingSummary:
+    """
+    Bounded-memory summary of a stream of values.
+
+    Parameters:
+    bin_edges (np.ndarray): Histogram bin edges. Values outside are counted
+    in an underflow / overflow bin.
+    """
+
+    def __init__(self, bin_edges: np.ndarray):
+        self.bin_edges = np.asarray(bin_edges, dtype=float)
+        self.counts = np.zeros(len(self.bin_edges) + 1, dtype=np.int64)
+        self.count = 0
+        self.failures = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, values: np.ndarray,
+               failed: Optional[np.ndarray] = None) -> 'StreamingSummary':
+        """Add a chunk of values and optionally their failure flags"""
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[~np.isnan(values)]
+        if failed is not None:
+            self.failures += int(np.count_nonzero(failed))
+        if not len(values):
+            return self
+
+        bins = np.searchsorted(self.bin_edges, values, side='right')
+        self.counts += np.bincount(bins, minlength=len(self.counts))
+
+        mean = values.mean()
+        self._merge_moments(len(values), mean, ((values - mean) ** 2).sum())
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        return self
+
+    def merge(self, other: 'StreamingSummary') -> 'StreamingSummary':
+        """Combine with the summary of another chunk or process"""
+        if not np.array_equal(self.bin_edges, other.bin_edges):
+            raise ValueError("Only summaries with equal bins can be merged")
+        self.counts += other.counts
+        self.failures += other.failures
+        self._merge_moments(other.count, other.mean, other.m2)
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def _merge_moments(self, count: int, mean: float, m2: float):
+        """Parallel mean / variance update (Chan et al.)"""
+        total = self.count + count
+        if not total:
+            return
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta ** 2 * self.count * count / total
+        self.count = total
+
+    @property
+    def std(self) -> float:
+        return np.sqrt(self.m2 / (self.count - 1)) if self.count > 1 \
+            else np.nan
+
+    @property
+    def failure_rate(self) -> float:
+        return self.failures / self.count if self.count else np.nan
+
+    def quantile(self, q: float) -> float:
+        """Approximate quantile, interpolated linearly within its bin"""
+        if not self.count:
+            return np.nan
+        edges = np.concatenate(([min(self.min, self.bin_edges[0])],
+                                self.bin_edges,
+                                [max(self.max, self.bin_edges[-1])]))
+        target = q * self.count
+        cumulative = np.cumsum(self.counts)
+        idx = min(np.searchsorted(cumulative, target, side='left'),
+                  len(self.counts) - 1)
+        below = cumulative[idx] - self.counts[idx]
+        fraction = (target - below) / self.counts[idx] if self.counts[idx] \
+            else 0
+        value = edges[idx] + fraction * (edges[idx + 1] - edges[idx])
+        return float(np.clip(value, self.min, self.max))
+
+    def summary(self) -> Dict[str, float]:
+        """Key metrics as used in the notebooks"""
+        return {
+            'count': self.count,
+            'mean': self.mean,
+            'std': self.std,
+            'min': self.min,
+            '1st percentile': self.quantile(0.01),
+            'median': self.quantile(0.5),
+            'max': self.max,
+            'failure rate': self.failure_rate
+        }
+
+
+def chunk_slices(num_items: int, chunk_size: int):
+    """Slices splitting range(num_items) into chunks"""
+    return (slice(i, min(i + chunk_size, num_items))
+            for i in range(0, num_items, chunk_size))
@@ -0,0 +1,135 @@
+"""
+Summary: Exact FIFO tax-lot accounting on arrays.
+
+Lots are kept as two arrays with a trailing lot axis (oldest lot first):
+the units held per lot and their cost per unit. Leading axes are the
+cross-section of start dates (and allocations), so all windows are
+processed together and a sale is a cumulative-sum over the lot axis.
+The amount to sell for a withdrawal plus the tax on the sale is solved
+exactly: within a lot the realized gain is linear in the amount sold.
+"""
+
+import numpy as np
+from typing import Dict, Tuple
+
+
+def initial_tax_lots(config: Dict,
+                     start_prices: np.ndarray) -> Tuple[np.ndarray,
+                                                        np.ndarray]:
+    """
+    Lots of the initial portfolio, from the config 'tax_lots': a list of
+    (value, invested) pairs, oldest first. Defaults to a single lot of
+    'initial_portfolio_value' bought for 'initial_portfolio_invested'.
+
+    Returns:
+    Tuple[np.ndarray, np.ndarray]: Units and cost per unit of shape
+    start_prices.shape + (lots,).
+    """
+    lots = np.asarray(config.get('tax_lots', [
+        (config['initial_portfolio_value'],
+         config['initial_portfolio_invested'])]), dtype=float)
+    values, invested = lots[:, 0], lots[:, 1]
+    if not np.isclose(values.sum(), config['initial_portfolio_value']):
+        raise ValueError(
+            "Values of 'tax_lots' must add up to 'initial_portfolio_value'")
+    lot_units = values / start_prices[..., None]
+    return lot_units, invested / lot_units
+
+
+def sell_fifo(lot_units: np.ndarray, lot_cost: np.ndarray,
+              units_sold: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Sell units first-in-first-out.
+
+    Returns:
+    Tuple[np.ndarray, np.ndarray]: Remaining units per lot and the cost
+    basis of the units sold.
+    """
+    held_before = np.cumsum(lot_units, axis=-1) - lot_units
+    sold = np.clip(units_sold[..., None] - held_before, 0, lot_units)
+    return lot_units - sold, (sold * lot_cost).sum(axis=-1)
+
+
+def annual_tax(year_gains: np.ndarray, gain: np.ndarray, tax_rate: float,
+               allowance: float) -> np.ndarray:
+    """Tax on a realized gain given the gains realized earlier in the tax
+    year and the annual tax-free allowance. Losses offset earlier gains of
+    the same year and refund their tax."""
+    taxed_before = np.maximum(year_gains - allowance, 0)
+    taxed_after = np.maximum(year_gains + gain - allowance, 0)
+    return tax_rate * (taxed_after - taxed_before)
+
+
+def sale_gains(lot_units: np.ndarray, lot_cost: np.ndarray,
+               amounts: np.ndarray, price: np.ndarray) -> np.ndarray:
+    """Realized gains of FIFO sales of several amounts (trailing axis),
+    each sold from the same lots"""
+    held_before = np.cumsum(lot_units, axis=-1) - lot_units
+    sold = np.clip((amounts / price[..., None])[..., None] -
+                   held_before[..., None, :], 0, lot_units[..., None, :])
+    return amounts - (sold * lot_cost[..., None, :]).sum(axis=-1)
+
+
+def withdraw_fifo(lot_units: np.ndarray, lot_cost: np.ndarray,
+                  year_gains: np.ndarray, withdrawal: np.ndarray,
+                  price: np.ndarray, config: Dict):
+    """
+    Sell enough units to pay the withdrawal and the capital gains tax on
+    everything sold, using exact FIFO cost basis and the annual allowance
+    'tax_free_threshold'.
+
+    The amount sold S solves S = withdrawal + tax(gain(S)). Both sides are
+    piecewise linear in S with breakpoints at the lot boundaries and where
+    the gains of the year reach the allowance, and S - tax(gain(S)) is
+    increasing (tax rate below 100%), so the root is interpolated exactly
+    between the breakpoints around it.
+
+    Returns:
+    Tuple: Total amount sold, remaining units per lot and the realized gains
+    of the tax year including this sale.
+    """
+    tax_rate = config['capital_gains_tax_rate']
+    allowance = config.get('tax_free_threshold', 0)
+
+    # Breakpoints: lot boundaries and the allowance kink within each lot
+    lot_cost_total = lot_units * lot_cost
+    bounds = np.concatenate((np.zeros(lot_units.shape[:-1] + (1,)),
+                             np.cumsum(lot_units, axis=-1) * price[..., None]),
+                            axis=-1)
+    lot_start = bounds[..., :-1]
+    gain_start = lot_start - (np.cumsum(lot_cost_total, axis=-1) -
+                              lot_cost_total)
+    gain_slope = 1 - lot_cost / price[..., None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        kinks = lot_start + (allowance - year_gains[..., None] -
+                             gain_start) / gain_slope
+    kinks = np.clip(np.where(np.isnan(kinks), lot_start, kinks), lot_start,
+                    bounds[..., 1:])
+    points = np.sort(np.concatenate((bounds, kinks), axis=-1), axis=-1)
+    excess = points - withdrawal[..., None] - annual_tax(
+        year_gains[..., None],
+        sale_gains(lot_units, lot_cost, points, price), tax_rate, allowance)
+
+    # Linear interpolation on the segment where the excess turns >= 0
+    crossed = excess >= 0
+    upper = np.maximum(np.argmax(crossed, axis=-1), 1)[..., None]
+    x0, x1 = (np.take_along_axis(points, upper - 1, axis=-1)[..., 0],
+              np.take_along_axis(points, upper, axis=-1)[..., 0])
+    f0, f1 = (np.take_along_axis(excess, upper - 1, axis=-1)[..., 0],
+              np.take_along_axis(excess, upper, axis=-1)[..., 0])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        within = np.where(f0 >= 0, x0, x0 - f0 * (x1 - x0) / (f1 - f0))
+
+    # Selling more than held: the gain grows one to one with the amount
+    gain_offset = year_gains - lot_cost_total.sum(axis=-1) - allowance
+    refund = tax_rate * np.maximum(year_gains - allowance, 0)
+    untaxed = withdrawal - refund
+    beyond = np.where(gain_offset + untaxed <= 0, untaxed,
+                      (withdrawal + tax_rate * gain_offset - refund) /
+                      (1 - tax_rate))
+    total_withdrawal = np.where(crossed.any(axis=-1), within, beyond)
+
+    lot_units, cost_sold = sell_fifo(lot_units, lot_cost,
+                                     total_withdrawal / price)
+    return total_withdrawal, lot_units, year_gains + (
+            total_withdrawal - cost_sold)
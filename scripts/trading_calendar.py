@@ -0,0 +1,115 @@
+"""
+Summary: Trading-day calendar with precomputed integer index maps.
+
+Price series are kept on their native trading days (no weekend or holiday
+rows). All date arithmetic of the cores is resolved once into integer
+positions of that series, so the simulations only do array lookups.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def to_day_numbers(dates) -> np.ndarray:
+    """Convert dates to integer day numbers (days since 1970-01-01)"""
+    return pd.DatetimeIndex(dates).values.astype('datetime64[D]').astype(
+        np.int64)
+
+
+class TradingCalendar:
+    """
+    Integer index maps over the trading days of a price series.
+
+    Attributes:
+    index (pd.DatetimeIndex): The trading days of the series.
+    days (np.ndarray): Day numbers of the trading days.
+    month_starts (np.ndarray): Positions of the first trading day per month.
+    month_ends (np.ndarray): Positions of the last trading day per month.
+    month_of_day (np.ndarray): Month number (index into month_starts) of
+    every trading day.
+    """
+
+    def __init__(self, index: pd.DatetimeIndex):
+        self.index = pd.DatetimeIndex(index)
+        self.days = to_day_numbers(self.index)
+        months = (self.index.year * 12 + self.index.month).to_numpy()
+        month_change = np.flatnonzero(np.diff(months)) + 1
+        self.month_starts = np.concatenate(([0], month_change))
+        self.month_ends = np.concatenate((month_change - 1,
+                                          [len(self.days) - 1]))
+        self.month_of_day = np.searchsorted(
+            self.month_starts, np.arange(len(self.days)), side='right') - 1
+
+    def __len__(self) -> int:
+        return len(self.days)
+
+    def on_or_after(self, day_numbers) -> np.ndarray:
+        """
+        Positions of the first trading day on/after the given day numbers.
+        Day numbers after the last trading day map to len(calendar).
+        """
+        return np.searchsorted(self.days, day_numbers, side='left')
+
+    def offset(self, positions, days: int) -> np.ndarray:
+        """Positions of the first trading day on/after position + days"""
+        return self.on_or_after(self.days[positions] + days)
+
+    def windows(self, period_days: int):
+        """
+        All complete investment windows of the given length.
+
+        Returns:
+        Tuple[np.ndarray, np.ndarray]: Start and end positions. The end is
+        the first trading day on/after start + period_days.
+        """
+        starts = np.arange(len(self.days))
+        starts = starts[self.days + period_days <= self.days[-1]]
+        return starts, self.offset(starts, period_days)
+
+    def next_month_start(self, positions) -> np.ndarray:
+        """Index into month_starts of the first month start on/after
+        positions"""
+        return np.searchsorted(self.month_starts, positions, side='left')
+
+    def next_month_end(self, positions) -> np.ndarray:
+        """Index into month_ends of the first month end on/after positions"""
+        return np.searchsorted(self.month_ends, positions, side='left')
+
+    def step_grid(self, starts, period_days: int,
+                  step_days: int) -> np.ndarray:
+        """
+        Positions of fixed calendar-day steps for each start position.
+
+        Row i holds the positions of start + k * step_days for
+        k = 0, 1, ... with the last step clipped to start + period_days.
+        """
+        num_steps = -(-period_days // step_days)
+        offsets = np.minimum(np.arange(num_steps + 1) * step_days,
+                             period_days)
+        start_days = self.days[np.asarray(starts)]
+        return self.on_or_after(start_days[:, None] + offsets[None, :])
+
+
+class MonthlyPanel:
+    """
+    Monthly view of prices on a trading calendar, built once per run so that
+    monthly-cadence studies loop over ~600 months instead of ~20k days.
+    The mappings between days and months are those of the calendar:
+    month_starts / month_ends (month -> day) and month_of_day (day -> month).
+
+    Attributes:
+    calendar (TradingCalendar): The daily calendar.
+    start_prices (np.ndarray): Prices on the first trading day per month.
+    end_prices (np.ndarray): Prices on the last trading day per month.
+    returns (np.ndarray): Returns from one month start to the next.
+    """
+
+    def __init__(self, prices: np.ndarray, calendar: TradingCalendar):
+        self.calendar = calendar
+        self.start_prices = prices[..., calendar.month_starts]
+        self.end_prices = prices[..., calendar.month_ends]
+        self.returns = self.start_prices[..., 1:] / self.start_prices[
+            ..., :-1] - 1
+
+    def __len__(self) -> int:
+        return len(self.calendar.month_starts)
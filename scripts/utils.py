@@ -4,8 +4,12 @@ Summary:Useful utility functions for the project
 
 import numpy as np
 import pandas as pd
-import yfinance as yf
 from datetime import datetime
+from typing import List, Optional, Tuple, Union
+from scripts.data_providers import fetch_prices
+
+# Anything numpy accepts to seed a random stream
+Seed = Optional[Union[int, np.random.SeedSequence, np.random.Generator]]
 
 
 def calculate_tax(
@@ -18,23 +22,46 @@ def calculate_tax(
     Calculate capital gains tax on withdrawal amount considering:
     - Tax-free threshold (monthly)
     - Cost basis (portion not subject to tax)
+    Works element-wise on numpy arrays as well.
     """
-    taxable_amount = max(
+    taxable_amount = np.maximum(
         (withdrawal_amount - tax_free_threshold) - cost_basis,
         0
     )
     return taxable_amount * tax_rate
 
 
+def history_range() -> Tuple[str, str]:
+    """Date range of the downloaded price histories"""
+    return '1970-01-01', datetime.today().strftime('%Y-%m-%d')
+
+
 def download_stock_data(stock_id: str) -> pd.Series:
-    """Download and process historical stock data"""
-    stock_data = yf.download(stock_id, start='1970-01-01',
-                             end=datetime.today().strftime('%Y-%m-%d'))
-    stock_data = stock_data.droplevel(1,
-                                      axis=1) if stock_data.columns.nlevels > 1 else stock_data
-    all_dates = pd.date_range(start=stock_data.index.min(),
-                              end=stock_data.index.max(), freq='D')
-    return stock_data.reindex(all_dates).ffill()['Close']
+    """
+    Download historical closing prices on their native trading days with
+    the configured data provider (see scripts.data_providers).
+    Date lookups are done via scripts.trading_calendar.TradingCalendar.
+    """
+    return fetch_prices([stock_id], *history_range())[stock_id]
+
+
+def annualized_growth(price_data: pd.Series) -> float:
+    """Average annual growth factor of a price series"""
+    price_ratio = price_data.iloc[-1] / price_data.iloc[0]
+    years = (price_data.index[-1] - price_data.index[0]).days / 365
+    return price_ratio ** (1 / years)
+
+
+def target_growth(price_data: pd.Series, annual_return,
+                  annual_management_fee: float = 0) -> float:
+    """
+    Target growth factor for scale_price_data. An annual_return of None
+    keeps the historical return of the series (e.g. for real or
+    currency-converted prices), reduced by the management fee.
+    """
+    if annual_return is None:
+        return annualized_growth(price_data) - annual_management_fee
+    return 1 + annual_return - annual_management_fee
 
 
 def scale_price_data(price_data: pd.Series,
@@ -49,15 +76,31 @@ def scale_price_data(price_data: pd.Series,
     Returns:
     pd.Series: A pandas Series containing the scaled price data.
     """
-    price_ratio = price_data.iloc[-1] / price_data.iloc[0]
-    years = (price_data.index[-1] - price_data.index[0]).days / 365
-    interest_rate = price_ratio ** (1 / years)
-    price_data_scaled = price_data.copy()
-    for i in range(len(price_data)):
-        price_data_scaled.iloc[i] = price_data.iloc[i] * (
-                target_interest_rate / interest_rate) ** (
-                                            i * years / len(price_data))
-    return price_data_scaled
+    interest_rate = annualized_growth(price_data)
+    # Elapsed calendar time, so gaps between trading days are respected
+    elapsed_years = (price_data.index - price_data.index[0]).days / 365
+    return price_data * (target_interest_rate / interest_rate) ** np.asarray(
+        elapsed_years)
+
+
+def as_seed_sequence(seed: Seed = None) -> np.random.SeedSequence:
+    """Seed sequence for a seed, a seed sequence or a generator (which is
+    advanced by drawing the seed from it)"""
+    if isinstance(seed, np.random.SeedSequence):
+        return seed
+    if isinstance(seed, np.random.Generator):
+        return np.random.SeedSequence(seed.integers(2 ** 63))
+    return np.random.SeedSequence(seed)
+
+
+def spawn_seeds(seed: Seed, num_streams: int
+                ) -> List[np.random.SeedSequence]:
+    """
+    Independent child seeds for parallel random streams. Stream i only
+    depends on seed and i, so results do not depend on how the streams are
+    distributed over workers.
+    """
+    return as_seed_sequence(seed).spawn(num_streams)
 
 
 if __name__ == "__main__":
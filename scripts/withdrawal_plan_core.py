@@ -1,81 +1,433 @@
 """Core functionality for withdrawal plan simulations"""
 
-from datetime import datetime, timedelta
+import numpy as np
 import pandas as pd
-from typing import Dict
-from scripts.utils import scale_price_data, download_stock_data, calculate_tax
+from typing import Dict, Iterable, Iterator
+from scripts.utils import calculate_tax
+from scripts.portfolio import as_stock_ids, load_portfolio_prices
+from scripts.trading_calendar import TradingCalendar, MonthlyPanel
+from scripts.withdrawal_policies import get_withdrawal_policy, \
+    fixed_withdrawal
+from scripts.kernels import NUMBA_AVAILABLE, withdrawal_months_kernel
+from scripts.tax_lots import initial_tax_lots, withdraw_fifo
+from scripts.streaming_stats import StreamingSummary, linear_bins, \
+    chunk_slices
+
+# Calendar days between two withdrawals
+WITHDRAWAL_STEP_DAYS = 30
+
+
+def effective_inflation(config: Dict):
+    """Inflation indexing the withdrawals: 'inflation', or 0 for real
+    prices (config 'cpi'), which already keep their purchasing power"""
+    return 0 if config.get('cpi') is not None else config['inflation']
 
 
 def simulate_withdrawals(
-        prices: pd.Series, start_date: datetime,
-        end_date: datetime, config: Dict
-) -> float:
-    portfolio_value = config['initial_portfolio_value']
-    cost_basis = config['initial_portfolio_invested'] # Track original
-    # investment
-    current_date = start_date
-    years_last = 0
-
-    while portfolio_value > 0 and current_date < end_date:
-        try:
-            # Monthly calculations
-            next_date = min(current_date + timedelta(days=30), end_date)
-            monthly_return = (prices.loc[next_date] / prices.loc[
-                current_date]) - 1
-
-            # Inflation-adjusted withdrawal
-            withdrawal = config['monthly_withdrawal'] * (
-                        1 + config['inflation'] / 12) ** years_last
-
-            # Calculate tax using utils function
-            capital_gains_tax = calculate_tax(
-                withdrawal_amount=withdrawal,
-                tax_rate=config['capital_gains_tax_rate'],
-                tax_free_threshold=config.get('tax_free_threshold', 0) / 12,
-                cost_basis=cost_basis * (withdrawal / portfolio_value)
-            )
-
-            total_withdrawal = withdrawal + capital_gains_tax
-
-            # Update portfolio and cost basis
-            portfolio_value -= total_withdrawal
-            cost_basis *= (1 - withdrawal / portfolio_value)  # Proportional
-            # cost basis
-            portfolio_value *= (1 + monthly_return)
-
-            years_last += 1 / 12
-            current_date = next_date
-
-        except (KeyError, ZeroDivisionError):
+        prices: np.ndarray, step_grid: np.ndarray, config: Dict,
+        record_income: bool = False, grid_years: np.ndarray = None
+):
+    """
+    Simulate monthly withdrawals for many start dates at once. The monthly
+    withdrawal is set by the config 'withdrawal_policy' (name or function,
+    see scripts.withdrawal_policies, default 'fixed').
+
+    The config 'cost_basis_method' selects the tax accounting:
+    'proportional' (default) approximates the cost basis with one running
+    value and a monthly share of 'tax_free_threshold', 'fifo' tracks exact
+    tax lots (see scripts.tax_lots) with 'tax_free_threshold' as annual
+    allowance per calendar year.
+
+    With the config 'backend': 'numba' the fixed policy with proportional
+    cost basis runs as compiled kernel (see scripts.kernels). Other
+    settings, or a missing numba installation, use the NumPy
+    implementation.
+
+    With the config 'cpi' the prices are in real terms, so 'inflation' is
+    ignored and all policies index withdrawals with an effective inflation
+    of 0 (see effective_inflation).
+
+    Parameters:
+    prices (np.ndarray): Prices of shape (trading days,) or (allocations,
+    trading days).
+    step_grid (np.ndarray): Trading-day positions of the withdrawal dates,
+    one row per start date (see TradingCalendar.step_grid).
+    record_income (bool): Also return the monthly withdrawals.
+    grid_years (np.ndarray): Calendar year of every price position (see
+    withdrawal_windows). The 'fifo' allowance restarts when a withdrawal
+    falls into a new calendar year; without grid_years tax years are
+    blocks of 12 withdrawals.
+    Numeric config entries (except 'withdrawal_period_years') may also be
+    arrays broadcasting against the result, e.g. one value per allocation.
+
+    Returns:
+    np.ndarray: Years lasted of shape (windows,) or (allocations, windows).
+    If record_income, additionally the withdrawals of shape
+    (..., windows, months), 0 once the portfolio is depleted.
+    """
+    config = dict(config, inflation=effective_inflation(config))
+    policy = get_withdrawal_policy(config.get('withdrawal_policy', 'fixed'))
+    use_lots = config.get('cost_basis_method', 'proportional') == 'fifo'
+    if (config.get('backend', 'numpy') == 'numba' and NUMBA_AVAILABLE and
+            policy is fixed_withdrawal and not use_lots and
+            not record_income):
+        return simulate_withdrawals_compiled(prices, step_grid, config)
+
+    shape = prices.shape[:-1] + (len(step_grid),)
+    num_steps = step_grid.shape[1] - 1
+    portfolio_value = np.zeros(shape) + config['initial_portfolio_value']
+    cost_basis = np.zeros(shape) + config['initial_portfolio_invested']
+    months_lasted = np.zeros(shape)
+    year_growth = np.ones(shape)
+    income = np.zeros(shape + (num_steps,)) if record_income else None
+    state = {
+        'previous_withdrawal': np.zeros(shape),
+        'last_year_return': np.zeros(shape)
+    }
+    if use_lots:
+        lot_units, lot_cost = initial_tax_lots(config,
+                                               prices[..., step_grid[:, 0]])
+        year_gains = np.zeros(shape)
+
+    for step in range(num_steps):
+        active = portfolio_value > 0
+        if not active.any():
             break
 
-    return min(years_last, config['withdrawal_period_years'])
+        if use_lots and grid_years is not None and step > 0:
+            new_year = (grid_years[step_grid[:, step]] !=
+                        grid_years[step_grid[:, step - 1]])
+            year_gains = np.where(new_year, 0, year_gains)
 
+        # Monthly calculations
+        current_price = prices[..., step_grid[:, step]]
+        monthly_return = (prices[..., step_grid[:, step + 1]] /
+                          current_price) - 1
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            state['step'] = step
+            state['portfolio_value'] = portfolio_value
+            withdrawal = np.broadcast_to(policy(state, config), shape)
+
+            if use_lots:
+                total_withdrawal, new_lot_units, new_year_gains = \
+                    withdraw_fifo(lot_units, lot_cost, year_gains,
+                                  withdrawal, current_price, config)
+                new_value = portfolio_value - total_withdrawal
+                new_cost_basis = cost_basis
+            else:
+                # Calculate tax using utils function
+                capital_gains_tax = calculate_tax(
+                    withdrawal_amount=withdrawal,
+                    tax_rate=config['capital_gains_tax_rate'],
+                    tax_free_threshold=config.get('tax_free_threshold',
+                                                  0) / 12,
+                    cost_basis=cost_basis * (withdrawal / portfolio_value)
+                )
+
+                # Update portfolio and cost basis
+                new_value = portfolio_value - (withdrawal + capital_gains_tax)
+                new_cost_basis = cost_basis * (1 - withdrawal / new_value)
+            new_value *= (1 + monthly_return)
+
+        # Depleted portfolios keep their state
+        portfolio_value = np.where(active, new_value, portfolio_value)
+        cost_basis = np.where(active, new_cost_basis, cost_basis)
+        months_lasted += active
+        if use_lots:
+            lot_units = np.where(active[..., None], new_lot_units, lot_units)
+            year_gains = np.where(active, new_year_gains, year_gains)
+        state['previous_withdrawal'] = np.where(
+            active, withdrawal, state['previous_withdrawal'])
+        if record_income:
+            income[..., step] = np.where(active, withdrawal, 0)
+
+        year_growth *= 1 + monthly_return
+        if (step + 1) % 12 == 0:
+            state['last_year_return'] = year_growth - 1
+            year_growth = np.ones(shape)
+            if use_lots and grid_years is None:
+                year_gains = np.zeros(shape)
+
+    years_lasted = np.minimum(months_lasted / 12,
+                              config['withdrawal_period_years'])
+    if record_income:
+        return years_lasted, income
+    return years_lasted
+
+
+def simulate_withdrawals_compiled(
+        prices: np.ndarray, step_grid: np.ndarray, config: Dict
+) -> np.ndarray:
+    """Compiled-kernel variant of simulate_withdrawals for the fixed policy
+    with proportional cost basis, same arguments and result"""
+    prices_2d = np.atleast_2d(np.asarray(prices, dtype=float))
+    shape = prices_2d.shape[:-1] + (len(step_grid),)
+    num_steps = step_grid.shape[1] - 1
+    withdrawal_growth = (1 + effective_inflation(config) / 12) ** (
+            np.arange(num_steps) / 12)
+    withdrawal_scale = np.broadcast_to(
+        np.asarray(config['monthly_withdrawal'], dtype=float), shape)
+
+    months_lasted = withdrawal_months_kernel(
+        prices_2d, np.ascontiguousarray(step_grid),
+        np.ascontiguousarray(withdrawal_scale), withdrawal_growth,
+        float(config['initial_portfolio_value']),
+        float(config['initial_portfolio_invested']),
+        float(config['capital_gains_tax_rate']),
+        config.get('tax_free_threshold', 0) / 12)
+
+    years_lasted = np.minimum(months_lasted / 12,
+                              config['withdrawal_period_years'])
+    return years_lasted.reshape(prices.shape[:-1] + (len(step_grid),))
+
+
+def sustainable_withdrawals(
+        prices: np.ndarray, step_grid: np.ndarray, config: Dict,
+        tolerance: float = 1.0, grid_years: np.ndarray = None
+) -> np.ndarray:
+    """
+    Largest initial 'monthly_withdrawal' lasting the full withdrawal period,
+    bisected for all start dates simultaneously. Works for every policy
+    that scales with 'monthly_withdrawal' (e.g. 'fixed', 'guyton_klinger').
+    Raises ValueError if withdrawing the whole initial portfolio value per
+    month still lasts, i.e. the policy ignores 'monthly_withdrawal' (e.g.
+    'constant_percentage', 'variable_percentage').
+
+    Parameters:
+    tolerance (float): Absolute precision of the result.
+    grid_years (np.ndarray): See simulate_withdrawals.
+
+    Returns:
+    np.ndarray: Sustainable monthly withdrawal of shape (windows,) or
+    (allocations, windows).
+    """
+    shape = prices.shape[:-1] + (len(step_grid),)
+    low = np.zeros(shape)
+    high = np.full(shape, float(config['initial_portfolio_value']))
+    years_lasted = simulate_withdrawals(
+        prices, step_grid, dict(config, monthly_withdrawal=high),
+        grid_years=grid_years)
+    if (years_lasted >= config['withdrawal_period_years']).any():
+        raise ValueError(
+            "The withdrawal policy does not scale with "
+            "'monthly_withdrawal', no sustainable withdrawal can be solved")
+
+    while (high - low).max() > tolerance:
+        middle = (low + high) / 2
+        years_lasted = simulate_withdrawals(
+            prices, step_grid, dict(config, monthly_withdrawal=middle),
+            grid_years=grid_years)
+        lasted = years_lasted >= config['withdrawal_period_years']
+        low = np.where(lasted, middle, low)
+        high = np.where(lasted, high, middle)
+
+    return low
+
+
+def withdrawal_windows(prices: np.ndarray, calendar: TradingCalendar,
+                       config: Dict):
+    """
+    Withdrawal step grid of all historical windows.
+
+    With the default config 'withdrawal_dates': 'daily' every trading day
+    starts a window and withdrawals follow in 30-day steps on the daily
+    prices. With 'monthly' windows start on the first trading day of each
+    month and withdrawals follow on the month starts of a MonthlyPanel, so
+    the simulation runs on ~600 monthly points. Monthly mode equals the
+    daily mode restricted to month-start windows, except that calendar
+    months replace the 30-day steps.
+
+    Returns:
+    Tuple[np.ndarray, pd.DatetimeIndex, np.ndarray, np.ndarray]: Prices
+    indexed by the grid, start date per window, the step grid and the
+    calendar year of every price position.
+    """
+    if config.get('withdrawal_dates', 'daily') == 'monthly':
+        panel = MonthlyPanel(prices, calendar)
+        num_months = config['withdrawal_period_years'] * 12
+        start_months = np.arange(len(panel) - num_months)
+        step_grid = start_months[:, None] + np.arange(num_months + 1)
+        return (panel.start_prices,
+                calendar.index[calendar.month_starts[start_months]],
+                step_grid,
+                calendar.index.year.to_numpy()[calendar.month_starts])
 
-def run_withdrawal_simulation(config: Dict) -> pd.DataFrame:
-    """Run full withdrawal simulation across historical periods"""
-    # Download and process data
-    raw_data = download_stock_data(config['stock_id'])
-    scaled_prices = scale_price_data(
-        raw_data,
-        1 + config['annual_return'] - config['annual_management_fee']
-    )
-
-    # Calculate simulation windows
     max_duration_days = config['withdrawal_period_years'] * 365
-    valid_start_dates = scaled_prices.index[:-max_duration_days]
+    valid_starts, _ = calendar.windows(max_duration_days)
+    step_grid = calendar.step_grid(valid_starts, max_duration_days,
+                                   WITHDRAWAL_STEP_DAYS)
+    return (prices, calendar.index[valid_starts], step_grid,
+            calendar.index.year.to_numpy())
+
+
+def load_prices(config: Dict):
+    """Scaled portfolio prices, start dates, step grid and grid years of a
+    config (see withdrawal_windows)"""
+    weights = config.get('weights', [1] * len(as_stock_ids(config)))
+    prices, calendar = load_portfolio_prices(
+        config, weights, config['annual_management_fee'])
+    return withdrawal_windows(prices[0], calendar, config)
+
+
+def run_allocation_sweep(config: Dict, allocations) -> pd.DataFrame:
+    """
+    Run the withdrawal simulation for several allocations over 'stock_id'
+    (a list of tickers) in one vectorized pass over all start dates.
+
+    Returns:
+    pd.DataFrame: Years lasted, one row per start date and one column per
+    allocation.
+    """
+    prices, calendar = load_portfolio_prices(
+        config, allocations, config['annual_management_fee'])
+    prices, start_dates, step_grid, grid_years = withdrawal_windows(
+        prices, calendar, config)
+    years_lasted = simulate_withdrawals(prices, step_grid, config,
+                                        grid_years=grid_years)
+    return pd.DataFrame(years_lasted.T,
+                        index=pd.Index(start_dates, name='Start Date'))
+
+
+def run_withdrawal_simulation(config: Dict) -> pd.DataFrame:
+    """Run full withdrawal simulation across historical periods.
+    Several tickers are held with the optional config 'weights'"""
+    prices, start_dates, step_grid, grid_years = load_prices(config)
 
     results = {
-        "Start Date": valid_start_dates,
-        "Years Lasted": [
-            simulate_withdrawals(
-                scaled_prices,
-                start,
-                start + timedelta(days=max_duration_days),
-                config
-            )
-            for start in valid_start_dates
-        ]
+        "Start Date": start_dates,
+        "Years Lasted": simulate_withdrawals(prices, step_grid, config,
+                                             grid_years=grid_years)
+    }
+
+    return pd.DataFrame(results)
+
+
+def run_policy_comparison(
+        config: Dict,
+        policies: Iterable = ('fixed', 'constant_percentage',
+                              'variable_percentage', 'guyton_klinger')
+) -> Dict[str, Dict]:
+    """
+    Run the withdrawal simulation for several withdrawal policies on the
+    same data, each in one vectorized pass over all start dates.
+
+    Returns:
+    Dict[str, Dict]: Per policy name:
+    - 'results': Years Lasted, Total Withdrawn and Lowest Withdrawal per
+      start date
+    - 'income': Monthly withdrawals, one row per start date
+    - 'success_rate': Share of start dates lasting the full period
+    """
+    prices, start_dates, step_grid, grid_years = load_prices(config)
+    start_dates = pd.Index(start_dates, name='Start Date')
+    target_months = config['withdrawal_period_years'] * 12
+
+    comparison = {}
+    for policy in policies:
+        years_lasted, income = simulate_withdrawals(
+            prices, step_grid, dict(config, withdrawal_policy=policy),
+            record_income=True, grid_years=grid_years)
+        income = income[:, :target_months]
+        name = policy if isinstance(policy, str) else policy.__name__
+        comparison[name] = {
+            'results': pd.DataFrame({
+                'Years Lasted': years_lasted,
+                'Total Withdrawn': income.sum(axis=1),
+                'Lowest Withdrawal': income.min(axis=1)
+            }, index=start_dates),
+            'income': pd.DataFrame(income, index=start_dates),
+            'success_rate': np.mean(
+                years_lasted >= config['withdrawal_period_years'])
+        }
+
+    return comparison
+
+
+def solve_safe_withdrawal(config: Dict, success_rate: float = 0.95,
+                          tolerance: float = 1.0) -> Dict:
+    """
+    Find the highest 'monthly_withdrawal' that lasts the full withdrawal
+    period in at least success_rate of all historical start dates, for the
+    tax and fee settings of the config.
+
+    Returns:
+    Dict: 'monthly_withdrawal' for the requested success rate and
+    'per_window', the sustainable withdrawal per start date.
+    """
+    prices, start_dates, step_grid, grid_years = load_prices(config)
+    safe = sustainable_withdrawals(prices, step_grid, config, tolerance,
+                                   grid_years)
+
+    # success_rate(w) is the share of windows with a sustainable
+    # withdrawal >= w
+    ranked = np.sort(safe)[::-1]
+    num_required = max(int(np.ceil(success_rate * len(ranked))), 1)
+
+    return {
+        'monthly_withdrawal': ranked[num_required - 1],
+        'per_window': pd.DataFrame({
+            'Start Date': start_dates,
+            'Safe Withdrawal': safe
+        })
     }
 
-    return pd.DataFrame(results)
\ No newline at end of file
+
+def iter_withdrawal_simulation(config: Dict, chunk_size: int = 4096
+                               ) -> Iterator[pd.DataFrame]:
+    """Chunked variant of run_withdrawal_simulation yielding the table in
+    pieces of chunk_size start dates (e.g. for
+    result_store.export_results)"""
+    prices, start_dates, step_grid, grid_years = load_prices(config)
+
+    for chunk in chunk_slices(len(step_grid), chunk_size):
+        yield pd.DataFrame({
+            'Start Date': start_dates[chunk],
+            'Years Lasted': simulate_withdrawals(prices, step_grid[chunk],
+                                                 config,
+                                                 grid_years=grid_years)
+        })
+
+
+def summarize_withdrawal_simulation(config: Dict, chunk_size: int = 4096
+                                    ) -> StreamingSummary:
+    """
+    Streaming variant of run_withdrawal_simulation: reduce the years lasted
+    of all start dates chunk by chunk into a mergeable summary (monthly
+    resolution). Start dates not lasting the full period count as failures.
+    """
+    prices, start_dates, step_grid, grid_years = load_prices(config)
+    target = config['withdrawal_period_years']
+    summary = StreamingSummary(linear_bins(0, target, target * 12))
+
+    for chunk in chunk_slices(len(step_grid), chunk_size):
+        years_lasted = simulate_withdrawals(prices, step_grid[chunk],
+                                            config, grid_years=grid_years)
+        summary.update(years_lasted, failed=years_lasted < target)
+
+    return summary
+
+
+if __name__ == "__main__":
+    # Check that the compiled and the NumPy backend agree on random prices
+    rng = np.random.default_rng(0)
+    dummy_index = pd.bdate_range('1990-01-01', '2020-12-31')
+    dummy_prices = 100 * np.exp(np.cumsum(
+        rng.normal(0.0003, 0.01, (2, len(dummy_index))), axis=1))
+    dummy_config = {
+        'initial_portfolio_value': 750000,
+        'initial_portfolio_invested': 200000,
+        'monthly_withdrawal': rng.uniform(2000, 5000, (2, 1)),
+        'withdrawal_period_years': 20,
+        'capital_gains_tax_rate': 0.1845,
+        'tax_free_threshold': 1000,
+        'inflation': 0.02
+    }
+    dummy_prices, _, dummy_grid, _ = withdrawal_windows(
+        dummy_prices, TradingCalendar(dummy_index), dummy_config)
+    numpy_result = simulate_withdrawals(dummy_prices, dummy_grid,
+                                        dummy_config)
+    compiled_result = simulate_withdrawals_compiled(dummy_prices, dummy_grid,
+                                                    dummy_config)
+    assert np.allclose(numpy_result, compiled_result)
+    print(f"Backends agree (numba available: {NUMBA_AVAILABLE})")
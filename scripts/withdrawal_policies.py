@@ -0,0 +1,103 @@
+"""
+Summary: Withdrawal policies for the withdrawal plan simulation.
+
+A policy is a function policy(state, config) -> monthly withdrawal. It is
+called once per month with arrays holding the cross-section of all start
+dates (and allocations), so every policy runs vectorized over all windows.
+
+The state dict provided by simulate_withdrawals contains:
+- 'step': Month number since the start of the withdrawals
+- 'portfolio_value': Portfolio value before this month's withdrawal
+- 'previous_withdrawal': Last month's withdrawal (0 in the first month)
+- 'last_year_return': Portfolio return of the last completed year
+Policies may keep their own arrays in the state as well.
+"""
+
+import numpy as np
+from typing import Callable, Dict, Union
+
+
+def fixed_withdrawal(state: Dict, config: Dict) -> np.ndarray:
+    """Fixed 'monthly_withdrawal', inflation-indexed as in the original
+    withdrawal plan"""
+    return config['monthly_withdrawal'] * (
+            1 + config['inflation'] / 12) ** (state['step'] / 12)
+
+
+def constant_percentage(state: Dict, config: Dict) -> np.ndarray:
+    """Withdraw 'withdrawal_rate' (annual, default 4%) of the current
+    portfolio value"""
+    return state['portfolio_value'] * config.get('withdrawal_rate', 0.04) / 12
+
+
+def variable_percentage(state: Dict, config: Dict) -> np.ndarray:
+    """
+    Variable percentage withdrawal (VPW): pay out the annuity payment that
+    would deplete the portfolio exactly at the end of the withdrawal period
+    if it grew with 'vpw_return' (annual, default 4%).
+    """
+    remaining = max(config['withdrawal_period_years'] * 12 - state['step'], 1)
+    monthly_rate = (1 + config.get('vpw_return', 0.04)) ** (1 / 12) - 1
+    if monthly_rate == 0:
+        payout = 1 / remaining
+    else:
+        payout = monthly_rate / (1 - (1 + monthly_rate) ** -remaining)
+    return state['portfolio_value'] * payout
+
+
+def guyton_klinger(state: Dict, config: Dict) -> np.ndarray:
+    """
+    Guyton-Klinger guardrails, applied once a year on the withdrawal:
+    - Inflation raise is skipped after a losing year if the current
+      withdrawal rate is above the initial rate
+    - Cut by 'guardrail_adjustment' (default 10%) if the rate exceeds the
+      initial rate by more than 'guardrail' (default 20%), except in the
+      last 'guardrail_stop_years' (default 15) years
+    - Raise by 'guardrail_adjustment' if the rate falls below the initial
+      rate by more than 'guardrail'
+    """
+    step = state['step']
+    portfolio_value = state['portfolio_value']
+    if step == 0:
+        return np.zeros_like(portfolio_value) + config['monthly_withdrawal']
+    withdrawal = state['previous_withdrawal']
+    if step % 12:
+        return withdrawal
+
+    initial_rate = config['monthly_withdrawal'] / config[
+        'initial_portfolio_value']
+    guardrail = config.get('guardrail', 0.2)
+    adjustment = config.get('guardrail_adjustment', 0.1)
+    years_left = config['withdrawal_period_years'] - step / 12
+
+    skip_inflation = ((state['last_year_return'] < 0) &
+                      (withdrawal / portfolio_value > initial_rate))
+    withdrawal = np.where(skip_inflation, withdrawal,
+                          withdrawal * (1 + config['inflation']))
+
+    current_rate = withdrawal / portfolio_value
+    cut = ((current_rate > initial_rate * (1 + guardrail)) &
+           (years_left > config.get('guardrail_stop_years', 15)))
+    raise_ = current_rate < initial_rate * (1 - guardrail)
+    return withdrawal * np.where(cut, 1 - adjustment,
+                                 np.where(raise_, 1 + adjustment, 1))
+
+
+WITHDRAWAL_POLICIES = {
+    'fixed': fixed_withdrawal,
+    'constant_percentage': constant_percentage,
+    'variable_percentage': variable_percentage,
+    'guyton_klinger': guyton_klinger,
+}
+
+
+def get_withdrawal_policy(policy: Union[str, Callable]) -> Callable:
+    """Look up a built-in policy by name, custom functions pass through"""
+    if callable(policy):
+        return policy
+    try:
+        return WITHDRAWAL_POLICIES[policy]
+    except KeyError:
+        raise ValueError(
+            f"Unknown withdrawal policy '{policy}', choose one of: "
+            f"{', '.join(WITHDRAWAL_POLICIES)}") from None